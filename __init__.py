@@ -1,10 +1,14 @@
-import hashlib
 import asyncio
+import copy
 import time
+import math
 import json
+import os
 import re
+from typing import Mapping
 
-from nonebot import get_driver, get_bots, require, on_shell_command
+from nonebot import get_driver, require, on_shell_command
+from nonebot.drivers import ReverseDriver, HTTPServerSetup, URL, Request, Response
 from nonebot.params import ShellCommandArgs
 from nonebot.permission import SUPERUSER
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, Message
@@ -14,6 +18,13 @@ from nonebot.log import logger
 import mcstatus
 
 from . import data
+from .dispatcher import message_dispatcher
+from .template import templates, render_cache
+from .history import History
+from .metrics import metrics
+from .resolver import resolver
+from .worker import WorkerPool, fork_available
+from .limiter import QueryLimiter
 
 require("nonebot_plugin_apscheduler")
 from nonebot_plugin_apscheduler import scheduler
@@ -23,68 +34,265 @@ global_config = get_driver().config
 plugin_config = Config.parse_obj(global_config)
 
 servers_data = data.Data()
+status_history = History(os.path.join(servers_data.config_path, "history.db"))
+query_cycle_timeout = plugin_config.QueryCycleTimeout or plugin_config.QueryInterval
+server_query_limiter = QueryLimiter(
+    plugin_config.QueryServerRate,
+    plugin_config.QueryServerBurst,
+    plugin_config.QueryServerGroupConcurrency,
+    plugin_config.QueryServerConcurrency,
+    plugin_config.QueryServerGlobalRate,
+    plugin_config.QueryServerGlobalBurst,
+)
+worker_pool = None  # type: WorkerPool | None
+if plugin_config.QueryWorkers > 0:
+    if fork_available():
+        worker_pool = WorkerPool(plugin_config.QueryWorkers, plugin_config.QueryConcurrency)
+    else:
+        logger.warning("当前系统不支持fork,无法使用查询子进程,将在主进程中查询")
+
+# 后台任务 保留引用避免被回收
+background_tasks = set()  # type: set[asyncio.Task]
+
+# 历史记录时段 => (汇总粒度, 时长)
+HISTORY_PERIODS = {
+    "小时": (60, 3600),
+    "天": (3600, 86400),
+    "周": (86400, 86400 * 7),
+    "月": (86400, 86400 * 30),
+}
+
+metrics.servers.function = lambda: len(servers_data.servers_map.servers)
+metrics.send_queue_depth.function = message_dispatcher.qsize
+metrics.breaker_open.function = lambda: sum(server.breaker_open() for server in servers_data.servers_map.servers.values())
+metrics.server_probe_duration.function = lambda: {
+    server.key: server.probe_duration for server in servers_data.servers_map.servers.values() if server.probe_duration is not None
+}
+
+
+async def exportMetrics(request: Request) -> Response:
+    """
+    导出Prometheus格式的监控指标
+    """
+    return Response(200, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}, content=metrics.export())
+
+
+if plugin_config.QueryMetricsPath and isinstance(get_driver(), ReverseDriver):
+    get_driver().setup_http_server(  # type: ignore
+        HTTPServerSetup(URL(plugin_config.QueryMetricsPath), "GET", "mcquery_metrics", exportMetrics)
+    )
+
+
+@get_driver().on_shutdown
+async def saveConfigData():
+    """
+    退出前写入尚未保存的配置和历史记录,关闭查询使用的套接字
+    """
+    await servers_data.flush_config_data()
+    await status_history.close()
+    data.bedrock_prober.close()
+    if worker_pool is not None:
+        worker_pool.shutdown()
+
+
+@get_driver().on_bot_connect
+@get_driver().on_bot_disconnect
+async def updateFanouts():
+    """
+    在线机器人改变后重新构建通知对象
+    """
+    servers_data.servers_map.clear_fanouts()
+
+
+async def watchConfigData():
+    """
+    检查配置文件是否被外部修改
+    """
+    await servers_data.check_config_data()
+
 
+if plugin_config.QueryConfigWatchInterval > 0:
+    scheduler.add_job(watchConfigData, "interval", seconds=plugin_config.QueryConfigWatchInterval)
 
-@scheduler.scheduled_job("interval", seconds=plugin_config.QueryInterval)
+
+@scheduler.scheduled_job(
+    "interval",
+    seconds=plugin_config.QueryTick,
+    max_instances=math.ceil(query_cycle_timeout / plugin_config.QueryTick) + 1
+)
 async def queryServerStatusChanged():
     """
     定时查询服务器状态是否改变
+    每个服务器有各自的查询时间,每次只查询到期的服务器
     状态改变则向群聊发送消息
     """
 
-    # logger.debug(f"开始查询服务器在线状态")
     start_time = time.time()
 
-    async def async_func_query(server: data.Server, server_hash: str):
-        start_query_time = time.time()
-        online_status_changed = await server.is_online_status_changed()
+    def on_query_finished(server: data.Server, online_status_changed, start_query_time: float, players: tuple[int, list | None] | None = None):
+        server.update_query_time(bool(online_status_changed), start_query_time)
+        if plugin_config.QueryPlayerNotify:
+            players_change = server.update_players(*(players or (None,)))
+            if players_change is not None:
+                players_changes[server.key] = players_change
         if online_status_changed:
             if online_status_changed == "online":
                 status_message = "离线=>在线"
-                result[server_hash] = plugin_config.format.server_state_change_online
+                result[server.key] = templates.server_state_change_online
             else:
                 status_message = "在线=>离线"
-                result[server_hash] = plugin_config.format.server_state_change_offline
-            logger.info(f"监测到服务器: {server.host}:{server.port}({server_hash}) 状态改变 {status_message}")
-
-    tasks = []
+                result[server.key] = templates.server_state_change_offline
+            logger.info(f"监测到服务器: {server.host}:{server.port} 状态改变 {status_message}")
+
+    async def async_func_query(server: data.Server):
+        start_query_time = time.monotonic()
+        online_status_changed, status = await server.is_online_status_changed()
+        status_history.record(
+            server.host,
+            server.port,
+            server.last_online_status == "online",
+            status
+        )
+        players = None
+        if server.last_online_status == "online":
+            if isinstance(status, mcstatus.pinger.PingResponse):
+                players = (status.players.online, status.players.sample)
+            elif isinstance(status, mcstatus.bedrock_status.BedrockStatusResponse):
+                players = (status.players_online, None)
+        on_query_finished(server, online_status_changed, start_query_time, players)
+
+    servers = []  # type: list[data.Server]
     result = {}
+    # 服务器地址 => (加入的玩家, 离开的玩家, 加入人数, 离开人数)
+    players_changes = {}  # type: dict[tuple[str, str, int], tuple[list[str], list[str], int, int]]
+
+    # 查询到期的服务器状态
+    now = time.monotonic()
+    for server in servers_data.servers_map.servers.values():
+        if server.next_query_time > now:
+            continue
+        # 先推迟下次查询时间,避免查询完成前被重复查询
+        server.next_query_time = now + server.query_interval
+        servers.append(server)
+
+    if not servers:
+        return
 
-    # 查询服务器状态
-    for server_hash in servers_data.servers_map.data:
-        server_data = servers_data.servers_map.get_server(server_hash)
-        tasks.append(asyncio.create_task(async_func_query(server_data["server"], server_data["hash"])))
-
-    if tasks:
-        await asyncio.wait(tasks)
-
-    # logger.debug(f"查询服务器状态完成,开始发送消息 耗时 {((time.time()-start_time)*1000):.0f}ms")
-
-    # 发送消息
-    tasks = []
-    bots = get_bots()
-    # logger.debug(f"bots:{bots} result:{result}")
-    for server_hash in result:
-        format_massage = result[server_hash]  # type: str
-        for bot_group_key in servers_data.servers_map.get_server(server_hash)["bot_groups"]:
-            bot_group_key: str
-            bot_id, group_id = bot_group_key.split()
-            bot_group_data = servers_data.servers_map.get_bot_group_data(server_hash, bot_id, group_id)
-
-            if not (bot_group_data["enable"] and bot_group_data["enable_check"]):
-                # 不允许检查状态,跳过
-                continue
-            if not bot_id in bots:
-                # 机器人不存在,跳过
-                continue
-
-            message = format_massage.format(**servers_data.servers_map.get_format_data(server_hash, bot_id, group_id))
-            tasks.append(asyncio.create_task(bots[bot_id].call_api("send_group_msg", group_id=group_id, message=message)))
-
-    if tasks:
-        await asyncio.wait(tasks)
-
-    # logger.debug(f"查询服务器在线完成 共耗时 {((time.time()-start_time)*1000):.0f}ms")
+    if worker_pool is None:
+        tasks = [asyncio.create_task(async_func_query(server)) for server in servers]
+        done, pending = await asyncio.wait(tasks, timeout=query_cycle_timeout)
+        for task in pending:
+            task.cancel()
+        unknown = len(pending)
+    else:
+        unknown = await query_servers_in_workers(worker_pool, servers, now, on_query_finished)
+    if unknown:
+        # 超过本轮查询时限,状态未知,保留上次的在线状态
+        metrics.cycle_unknown.inc(value=unknown)
+        logger.warning(f"{unknown} 个服务器未在本轮查询时限内完成,状态未知")
+
+    logger.debug(f"查询 {len(servers)} 个服务器状态完成,开始发送消息 耗时 {((time.time()-start_time)*1000):.0f}ms")
+
+    # 发送消息 由发送队列合并同一群聊的消息并限速发送
+    for server_key in result:
+        format_massage = result[server_key]
+        for target in servers_data.servers_map.get_fanout(server_key).check:
+            message = render_cache.get(
+                format_massage, server_key, None, target.format_data,
+                lambda: format_massage.render(**target.format_data)
+            )
+            message_dispatcher.send_group_msg(target.bot_id, target.group_id, message)
+
+    # 玩家加入和离开 每个服务器每轮只发送一条消息
+    for server_key, players_change in players_changes.items():
+        for target in servers_data.servers_map.get_fanout(server_key).players:
+            message = render_cache.get(
+                templates.server_players_join, server_key, players_change, target.format_data,
+                lambda: format_players_change(players_change, target.format_data),
+                templates.server_players_change_fields
+            )
+            message_dispatcher.send_group_msg(target.bot_id, target.group_id, message)
+
+    # 批量写入本轮的历史记录
+    await status_history.flush()
+
+    metrics.cycle_duration.observe(time.time() - start_time)
+    logger.debug(f"查询服务器在线完成 共耗时 {((time.time()-start_time)*1000):.0f}ms")
+
+
+def format_players_change(players_change: tuple[list[str], list[str], int, int], format_data: Mapping[str, object]) -> Message:
+    """
+    玩家加入和离开的消息,玩家较多时只列出前 QueryPlayerNotifyNames 个
+    """
+    joined, left, joined_count, left_count = players_change
+    message = Message()
+    for renderer, names, count in [
+        (templates.server_players_join, joined, joined_count),
+        (templates.server_players_leave, left, left_count),
+    ]:
+        if not count:
+            continue
+        if names:
+            players = ", ".join(names[:plugin_config.QueryPlayerNotifyNames])
+            if count > plugin_config.QueryPlayerNotifyNames:
+                players += f" 等{count}人"
+        else:
+            players = f"{count}人"
+        if message:
+            message += "\n"
+        message += renderer.render(**format_data, players=players, players_count=count)
+    return message
+
+
+async def query_servers_in_workers(pool: WorkerPool, servers: list[data.Server], start_time: float, callback) -> int:
+    """
+    在查询子进程中查询服务器在线状态
+    域名在主进程中解析,子进程只返回在线状态、在线人数和延迟,结果不写入状态缓存
+    返回未在本轮查询时限内完成的服务器数量
+    """
+    servers_by_key = {server.key: server for server in servers}
+    ips = await asyncio.gather(*[resolver.resolve(server.host) for server in servers], return_exceptions=True)
+    probe_servers = []
+    for server, ip in zip(servers, ips):
+        if isinstance(ip, BaseException):
+            # 域名解析失败,视为离线
+            metrics.probe_errors.inc(server.type, type(ip).__name__)
+            status_history.record(server.host, server.port, False)
+            callback(server, server.set_online_status("offline"), start_time)
+        else:
+            probe_servers.append((server.type, server.host, ip, server.port))
+    if not probe_servers:
+        return 0
+
+    unknown = len(probe_servers)
+    try:
+        for future in asyncio.as_completed(
+            pool.probe(probe_servers, plugin_config.QueryProbeMode, plugin_config.QueryTimeout),
+            timeout=query_cycle_timeout - (time.monotonic() - start_time)
+        ):
+            for probe_result in await future:
+                unknown -= 1
+                server = servers_by_key.get((probe_result.type, probe_result.host, probe_result.port))
+                if server is None:
+                    continue
+                mode = "status" if server.type == "bedrock" else plugin_config.QueryProbeMode
+                server.record_probe_duration(probe_result.duration)
+                metrics.probe_duration.observe(probe_result.duration, server.type, mode)
+                if probe_result.error is not None:
+                    metrics.probe_errors.inc(server.type, probe_result.error)
+                status_history.record(
+                    server.host, server.port, probe_result.online,
+                    players=probe_result.players, latency=probe_result.latency
+                )
+                callback(
+                    server,
+                    server.set_online_status("online" if probe_result.online else "offline"),
+                    start_time,
+                    (probe_result.players, None) if probe_result.players is not None else None
+                )
+    except asyncio.TimeoutError:
+        pass
+    return unknown
 
 
 parser = ArgumentParser("mc")
@@ -98,6 +306,11 @@ query.add_argument("type", default="java")
 # 列表
 query_list = subparsers.add_parser("列表", help="查看列表")
 
+# 历史
+query_history = subparsers.add_parser("历史", help="查询服务器历史")
+query_history.add_argument("name")
+query_history.add_argument("period", nargs="?", default="天", choices=list(HISTORY_PERIODS))
+
 
 # 管理命令
 admin_parser = ArgumentParser("mc")
@@ -123,6 +336,9 @@ setting_set.add_argument("value")
 setting_set = setting_subparsers.add_parser("读取")
 setting_set.add_argument("key")
 
+# 统计
+statistics = admin_subparsers.add_parser("统计", help="查看运行统计")
+
 
 admin_command_query = on_shell_command("查询", parser=admin_parser, permission=SUPERUSER)
 
@@ -144,6 +360,8 @@ async def queryAllServersAdmin(bot: Bot, event: GroupMessageEvent, args: Namespa
                 await setting_group_set(bot, event, args.key, args.value)
             elif args.mode == "读取":
                 await setting_group_get(bot, event, args.key)
+        case "统计":
+            await show_statistics(bot, event)
 
 
 command_query = on_shell_command("查询", parser=parser)
@@ -165,6 +383,8 @@ async def queryAllServers(bot: Bot, event: GroupMessageEvent, args: Namespace =
             await query_server(bot, event, args.address, args.type)
         case "列表":
             ...
+        case "历史":
+            await query_server_history(bot, event, args.name, args.period)
 
 
 @command_query.handle()
@@ -179,48 +399,162 @@ async def query_group(bot: Bot, event: GroupMessageEvent):
     message = Message()
     bot_id = bot.self_id
     group_id = str(event.group_id)
-    group_data = servers_data.get_group_data(bot_id, group_id)
-    server_list = group_data["servers"]
+    group = servers_data.servers_map.get_group(bot_id, group_id)
 
-    if not (group_data["enable"] and group_data["enable_query"]):
+    if group is None or not (group.enable and group.enable_query):
         # 不允许查询,退出
         return
 
-    if not server_list:
+    if not group.subscriptions:
         await bot.send(event, message=plugin_config.format.group_no_servers)
         return
+    elif plugin_config.QueryStaleReply:
+        await query_group_stale(bot, event, group)
+        return
     else:
         await bot.send(event, message=plugin_config.format.group_start_query)
 
     logger.info("开始查询群聊服务器")
 
-    async def async_query_server(server: data.Server, server_hash: str):
-        status = await server.status()
-        result[server_hash] = status
+    servers = {subscription.server.key: subscription.server for subscription in group.subscriptions}
+    result, pending = await wait_servers_status(servers, plugin_config.QueryReplyDeadline)
 
-    result = {}  # type: dict[str,mcstatus.pinger.PingResponse | mcstatus.bedrock_status.BedrockStatusResponse | None]
-    tasks = []
+    for subscription in group.subscriptions:
+        if subscription.server.key in result:
+            message += servers_data.servers_map.create_server_message(subscription, result[subscription.server.key])
+        else:
+            message += servers_data.servers_map.create_timeout_message(subscription)
+        message += ("" if subscription is group.subscriptions[-1] else "\n")
+
+    await bot.send(event, message)
+    send_late_results(bot, event, group, pending)
 
-    for server_data in server_list:
-        server_hash = hashlib.sha256(f'{server_data["host"]}:{server_data["port"]}'.encode()).hexdigest()
-        server = servers_data.servers_map.get_server(server_hash)["server"]  # type: data.Server
-        tasks.append(asyncio.create_task(async_query_server(server, server_hash)))
 
+async def wait_servers_status(servers: dict[tuple[str, str, int], data.Server], timeout: float | None):
+    """
+    查询服务器状态,最多等待 timeout 秒
+    返回 (已完成的查询结果, 未完成的查询任务), 未完成的查询继续进行并写入缓存
+    """
+    for server in servers.values():
+        server.reset_breaker()
+    tasks = {key: asyncio.create_task(server.status()) for key, server in servers.items()}
     if tasks:
-        await asyncio.wait(tasks)
+        await asyncio.wait(tasks.values(), timeout=timeout)
+    result = {key: task.result() for key, task in tasks.items() if task.done()}
+    pending = {key: task for key, task in tasks.items() if not task.done()}
+    return result, pending
+
+
+def send_late_results(bot: Bot, event: GroupMessageEvent, group: data.Group, pending: dict[tuple[str, str, int], asyncio.Task]):
+    """
+    QueryReplyLateMode 为 followup 时,在后台等待超过回复时限的服务器,全部完成后合并为一条消息发送
+    """
+    if not pending or plugin_config.QueryReplyLateMode != "followup":
+        return
+
+    async def wait_and_send():
+        await asyncio.wait(pending.values())
+        message = Message(plugin_config.format.group_query_late)
+        for subscription in group.subscriptions:
+            if subscription.server.key in pending:
+                message += "\n"
+                message += servers_data.servers_map.create_server_message(subscription, pending[subscription.server.key].result())
+        try:
+            await bot.send(event, message)
+        except Exception as e:
+            logger.warning(f"发送查询较慢的服务器状态失败 {type(e).__name__}: {e}")
+
+    task = asyncio.create_task(wait_and_send())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
-    for server_data in server_list:
-        server_hash = hashlib.sha256(f'{server_data["host"]}:{server_data["port"]}'.encode()).hexdigest()
-        message += servers_data.servers_map.create_server_message(server_hash, bot.self_id, group_id, result[server_hash])
-        message += ("" if server_data == server_list[-1] else "\n")
 
+def get_status_summary(status):
+    """
+    用于判断状态是否有明显变化的摘要
+    """
+    if status is None:
+        return None
+    if isinstance(status, mcstatus.pinger.PingResponse):
+        return status.version.name, status.players.online, status.players.max
+    return status.version.version, status.players_online, status.players_max
+
+
+async def query_group_stale(bot: Bot, event: GroupMessageEvent, group: data.Group):
+    """
+    使用最近一次的查询结果立即回复
+    没有查询结果的服务器先查询,过期的结果标注时间后在后台重新查询
+    """
+    servers = {subscription.server.key: subscription.server for subscription in group.subscriptions}
+    for server in servers.values():
+        server.reset_breaker()
+    snapshots = {key: data.status_cache.peek(key) for key in servers}
+    missing = {key: server for key, server in servers.items() if snapshots[key] is None}
+    result, pending = await wait_servers_status(missing, plugin_config.QueryReplyDeadline)
+    for key, status in result.items():
+        snapshots[key] = (time.monotonic(), status)
+
+    now = time.monotonic()
+    message = Message()
+    stale = {}  # type: dict[tuple[str, str, int], data.Server]
+    for subscription in group.subscriptions:
+        if subscription.server.key in pending:
+            message += servers_data.servers_map.create_timeout_message(subscription)
+            message += ("" if subscription is group.subscriptions[-1] else "\n")
+            continue
+        update_time, status = snapshots[subscription.server.key]  # type: ignore
+        message += servers_data.servers_map.create_server_message(subscription, status)
+        if now - update_time > plugin_config.QueryCacheTTL:
+            message += plugin_config.format.group_status_age.format(age=int(now - update_time))
+            stale[subscription.server.key] = subscription.server
+        message += ("" if subscription is group.subscriptions[-1] else "\n")
     await bot.send(event, message)
+    send_late_results(bot, event, group, pending)
+
+    if stale:
+        task = asyncio.create_task(refresh_group_stale(bot, event, group, stale, snapshots))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def refresh_group_stale(bot: Bot, event: GroupMessageEvent, group: data.Group, servers: dict, snapshots: dict):
+    """
+    重新查询过期的服务器,状态有变化时发送更新后的服务器消息
+    """
+    statuses = dict(zip(servers, await asyncio.gather(*[server.status() for server in servers.values()])))
+    changed = [
+        subscription for subscription in group.subscriptions
+        if subscription.server.key in statuses
+        and get_status_summary(statuses[subscription.server.key]) != get_status_summary(snapshots[subscription.server.key][1])
+    ]
+    if not changed:
+        return
+    message = Message(plugin_config.format.group_status_updated)
+    for subscription in changed:
+        message += "\n"
+        message += servers_data.servers_map.create_server_message(subscription, statuses[subscription.server.key])
+    try:
+        await bot.send(event, message)
+    except Exception as e:
+        logger.warning(f"发送更新后的服务器状态失败 {type(e).__name__}: {e}")
 
 
 async def query_server(bot: Bot, event: GroupMessageEvent, address: str, server_type: str):
-    host, port = address.split(":") + [(19132 if server_type.lower() == "bedrock" else 25565)]
+    """
+    查询任意服务器
+    复用已监测或最近查询过的服务器,离线结果也会缓存一段时间
+    缓存未命中时按群聊限流,避免占满查询资源
+    """
+    if not server_type.lower() in ["java", "bedrock"]:
+        await bot.send(event, plugin_config.format.group_server_type_error)
+        return
+    host, port = (address.split(":", 1) + [(19132 if server_type.lower() == "bedrock" else 25565)])[:2]
     port = int(port)
-    server = data.Server(server_type, host, port)  # type: ignore
+    server = servers_data.servers_map.servers.get((server_type.lower(), host, port))
+    if server is None:
+        server = data.adhoc_servers.get(server_type, host, port)
+    else:
+        server.reset_breaker()
     bot_id = bot.self_id
     group_id = str(event.group_id)
     format_data = {
@@ -231,8 +565,48 @@ async def query_server(bot: Bot, event: GroupMessageEvent, address: str, server_
         "bot_id": bot_id,
         "group_id": group_id,
     }
-    server_status = await server.status()
-    await bot.send(event, servers_data.servers_map.format_server_message(server_status, format_data))
+    cache_ttl = plugin_config.QueryServerCacheTTL
+    negative_ttl = plugin_config.QueryServerNegativeTTL
+    hit, server_status = data.status_cache.get(server.key, cache_ttl, negative_ttl)
+    if not hit:
+        group_key = (bot_id, group_id)
+        if not server_query_limiter.acquire(group_key):
+            await bot.send(event, plugin_config.format.group_query_too_frequent)
+            return
+        try:
+            server_status = await server.status(cache_ttl, negative_ttl)
+        finally:
+            server_query_limiter.release(group_key)
+    await bot.send(event, servers_data.servers_map.render_server_message(server.key, server_status, format_data))
+
+
+async def query_server_history(bot: Bot, event: GroupMessageEvent, name: str, period: str):
+    group = servers_data.servers_map.get_group(bot.self_id, str(event.group_id))
+    if group is None or not (group.enable and group.enable_query):
+        # 不允许查询,退出
+        return
+
+    for subscription in group.subscriptions:
+        if subscription.name == name:
+            break
+    else:
+        await bot.send(event, plugin_config.format.group_server_not_found)
+        return
+
+    level, span = HISTORY_PERIODS[period]
+    summary = await status_history.summary(subscription.host, subscription.port, level, span)
+    if summary is None:
+        await bot.send(event, plugin_config.format.group_history_empty)
+        return
+    count, online_count, players_avg, players_max, latency_avg = summary
+    await bot.send(event, plugin_config.format.group_history.format(
+        **servers_data.servers_map.get_format_data(subscription),
+        period=period,
+        uptime=online_count / count * 100,
+        players_avg="-" if players_avg is None else f"{players_avg:.1f}",
+        players_max="-" if players_max is None else players_max,
+        latency_avg="-" if latency_avg is None else f"{latency_avg:.0f}",
+    ))
 
 
 async def add_server(bot: Bot, event: GroupMessageEvent, name: str, address: str, server_type: str):
@@ -263,7 +637,10 @@ async def remove_server(bot: Bot, event: GroupMessageEvent, name: str):
 
 async def setting_group_set(bot: Bot, event: GroupMessageEvent, path: str, value):
     servers_data.get_group_data(bot.self_id, str(event.group_id))
-    group_data = servers_data.config_data["bots"][bot.self_id]["groups"][str(event.group_id)]
+    groups = servers_data.config_data["bots"][bot.self_id]["groups"]
+    group_data = groups[str(event.group_id)]
+    # 修改失败时恢复原有的配置
+    old_group_data = copy.deepcopy(group_data)
 
     try:
         value = json.loads(value)
@@ -276,17 +653,22 @@ async def setting_group_set(bot: Bot, event: GroupMessageEvent, path: str, value
                 temp[key] = value
             else:
                 temp = temp[key]
+        servers_data.servers_map.load_group(bot.self_id, str(event.group_id))
         servers_data.save_config_data()
-    except KeyError:
-        await bot.send(event, plugin_config.format.group_setting_failed.format(reason="KeyError"))
-    except json.decoder.JSONDecodeError:
-        await bot.send(event, plugin_config.format.group_setting_failed.format(reason="JSONDecodeError"))
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        groups[str(event.group_id)] = old_group_data
+        await bot.send(event, plugin_config.format.group_setting_failed.format(reason=type(e).__name__))
     else:
         await bot.send(event, plugin_config.format.group_setting_success)
 
 
 async def setting_group_get(bot: Bot, event: GroupMessageEvent, path: str):
     group_data = servers_data.get_group_data(bot.self_id, str(event.group_id))
+    # 只读的服务器熔断状态
+    group = servers_data.servers_map.get_group(bot.self_id, str(event.group_id))
+    group_data["breaker"] = {
+        subscription.name: subscription.server.breaker_state() for subscription in (group.subscriptions if group else [])
+    }
     try:
         temp = group_data
         key_list = path.split(".") if path != "." else []
@@ -299,3 +681,35 @@ async def setting_group_get(bot: Bot, event: GroupMessageEvent, path: str):
         await bot.send(event, plugin_config.format.group_setting_read_failed.format(reason="KeyError"))
     else:
         await bot.send(event, f"{type(temp).__name__.upper()} {json.dumps(temp,indent=4, ensure_ascii=False)}")
+
+
+async def show_statistics(bot: Bot, event: GroupMessageEvent):
+    def format_rate(rate: float | None):
+        return "-" if rate is None else f"{rate * 100:.1f}%"
+
+    def format_time(seconds: float | None):
+        return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+    cycles = metrics.cycle_duration.count()
+    # 查询耗时最长的服务器
+    slowest = sorted(
+        (server for server in servers_data.servers_map.servers.values() if server.probe_duration is not None),
+        key=lambda server: server.probe_duration, reverse=True  # type: ignore
+    )[:5]
+    slow_servers = ", ".join(f"{server.host}:{server.port}({server.type}) {format_time(server.probe_duration)}ms" for server in slowest)
+    errors = ", ".join(f"{error}({server_type})x{count:.0f}" for (server_type, error), count in metrics.probe_errors.values.items())
+    await bot.send(event, plugin_config.format.group_statistics.format(
+        servers=metrics.servers.get(),
+        cycles=cycles,
+        cycle_avg=format_time(metrics.cycle_duration.sum() / cycles if cycles else None),
+        probe_p50=format_time(metrics.probe_duration.quantile(0.5)),
+        probe_p99=format_time(metrics.probe_duration.quantile(0.99)),
+        errors=errors or "无",
+        slow_servers=slow_servers or "无",
+        unknown=f"{metrics.cycle_unknown.get():.0f}",
+        queue_depth=metrics.send_queue_depth.get(),
+        status_hit_rate=format_rate(metrics.cache_hit_rate("status")),
+        favicon_hit_rate=format_rate(metrics.cache_hit_rate("favicon")),
+        dns_hit_rate=format_rate(metrics.cache_hit_rate("dns")),
+        render_hit_rate=format_rate(metrics.cache_hit_rate("render")),
+    ))
@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import ipaddress
+import itertools
+import socket
+import time
+
+from mcstatus.bedrock_status import BedrockServerStatus, BedrockStatusResponse
+
+# 查询子进程中也会使用,不能依赖 NoneBot
+
+RAKNET_MAGIC = bytes.fromhex("00ffff00fefefefefdfdfdfd12345678")
+# 未连接Pong: 包ID(1) 时间(8) 服务器GUID(8) MAGIC(16) 字符串长度(2)
+PONG_HEADER_SIZE = 35
+
+
+class BedrockProtocol(asyncio.DatagramProtocol):
+    def __init__(self, prober: "BedrockProber", family: int):
+        self.prober = prober
+        self.family = family
+
+    def datagram_received(self, data: bytes, addr):
+        self.prober.on_pong(data, addr)
+
+    def error_received(self, exc: Exception):
+        # 无连接的UDP套接字无法确定错误对应的服务器,等待超时
+        pass
+
+    def connection_lost(self, exc: Exception | None):
+        self.prober.on_connection_lost(self.family, exc)
+
+
+class BedrockProber:
+    """
+    基岩服务器查询
+    所有查询共用一个UDP套接字发送未连接Ping,按来源地址和Ping ID匹配回复
+    超时由一个定时器统一处理,查询超时时间相同,按发送顺序排队即可
+    """
+
+    # 接收缓冲区大小,同时查询大量服务器时避免回复被丢弃
+    RECEIVE_BUFFER_SIZE = 1 << 20
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.transports = {}  # type: dict[int, asyncio.DatagramTransport]
+        self.opening = {}  # type: dict[int, asyncio.Task]
+        self.ping_ids = itertools.count(1)
+        # (ip, 端口, Ping ID) => (Future, 发送时间)
+        self.pending = {}  # type: dict[tuple[str, int, bytes], tuple[asyncio.Future, float]]
+        # (超时时间, 键) 按发送顺序排列
+        self.deadlines = collections.deque()  # type: collections.deque[tuple[float, tuple[str, int, bytes]]]
+        self.timer = None  # type: asyncio.TimerHandle | None
+
+    async def status(self, ip: str, port: int) -> BedrockStatusResponse:
+        """
+        查询服务器状态, ip 必须是IP地址
+        超时抛出 asyncio.TimeoutError
+        """
+        # 回复的来源地址是规范形式,按规范形式匹配
+        ip = ipaddress.ip_address(ip).compressed
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        transport = await self._transport(family)
+        loop = asyncio.get_running_loop()
+        ping_id = next(self.ping_ids).to_bytes(8, "big")
+        key = (ip, port, ping_id)
+        future = loop.create_future()
+        self.pending[key] = (future, time.perf_counter())
+        deadline = loop.time() + self.timeout
+        self.deadlines.append((deadline, key))
+        if self.timer is None:
+            self.timer = loop.call_at(deadline, self._expire)
+        try:
+            transport.sendto(b"\x01" + ping_id + RAKNET_MAGIC + b"\x00" * 8, (ip, port))
+            return await future
+        finally:
+            self.pending.pop(key, None)
+
+    async def _transport(self, family: int) -> asyncio.DatagramTransport:
+        transport = self.transports.get(family)
+        if transport is not None:
+            return transport
+        task = self.opening.get(family)
+        if task is None:
+            task = asyncio.create_task(self._open(family))
+            self.opening[family] = task
+            task.add_done_callback(lambda _: self.opening.pop(family, None))
+        return await asyncio.shield(task)
+
+    async def _open(self, family: int):
+        local_address = ("::", 0) if family == socket.AF_INET6 else ("0.0.0.0", 0)
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: BedrockProtocol(self, family), local_addr=local_address, family=family
+        )
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER_SIZE)
+            except OSError:
+                pass
+        self.transports[family] = transport
+        return transport
+
+    def on_pong(self, data: bytes, addr):
+        if len(data) < PONG_HEADER_SIZE or data[0] != 0x1C:
+            return
+        item = self.pending.pop((addr[0], addr[1], data[1:9]), None)
+        if item is None:
+            return
+        future, start_time = item
+        if future.done():
+            return
+        try:
+            future.set_result(BedrockServerStatus.parse_response(data, (time.perf_counter() - start_time) * 1000))
+        except Exception as e:
+            future.set_exception(e)
+
+    def on_connection_lost(self, family: int, exc: Exception | None):
+        self.transports.pop(family, None)
+        for key, (future, _) in list(self.pending.items()):
+            if (":" in key[0]) == (family == socket.AF_INET6) and not future.done():
+                future.set_exception(exc or ConnectionError("UDP套接字已关闭"))
+
+    def _expire(self):
+        """
+        处理到期的查询,并把定时器设置到下一个超时时间
+        """
+        self.timer = None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, key = self.deadlines.popleft()
+            item = self.pending.pop(key, None)
+            if item is not None and not item[0].done():
+                item[0].set_exception(asyncio.TimeoutError())
+        # 已完成的查询无需等待超时
+        while self.deadlines and not self.deadlines[0][1] in self.pending:
+            self.deadlines.popleft()
+        if self.deadlines:
+            self.timer = loop.call_at(self.deadlines[0][0], self._expire)
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for transport in list(self.transports.values()):
+            transport.close()
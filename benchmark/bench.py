@@ -0,0 +1,254 @@
+"""
+性能测试
+在本地启动大量模拟服务器,测试定时查询、群聊查询和消息格式化的性能
+
+    python benchmark/bench.py --java 2000 --bedrock 1000 --groups 300
+
+模拟服务器使用 127.0.0.0/8 中的地址,仅支持Linux
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import nonebot
+
+from fake_server import FakeServers, FakeServerOptions
+
+PLUGIN_NAME = "nonebot_plugin_minecraft_query"
+PLUGIN_PATH = Path(__file__).resolve().parent.parent
+
+
+class StubBot:
+    """
+    模拟的 OneBot 机器人,只记录调用次数
+    """
+
+    def __init__(self, self_id: str, api_latency: float):
+        self.self_id = self_id
+        self.api_latency = api_latency
+        self.calls = 0
+
+    async def call_api(self, api: str, **data):
+        self.calls += 1
+        await asyncio.sleep(self.api_latency)
+
+    async def send(self, event, message, **kwargs):
+        await self.call_api("send_msg", message=message)
+
+
+class FDSampler:
+    """
+    定期统计打开的文件描述符数量,记录峰值
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, len(os.listdir("/proc/self/fd")))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def timing_report(values: list[float], count: int) -> dict:
+    total = sum(values)
+    return {
+        "runs": len(values),
+        "p50_ms": percentile(values, 0.5) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+        "throughput_per_s": count * len(values) / total if total else 0.0,
+    }
+
+
+def create_config_data(fake_servers: FakeServers, bot_id: str, groups: int, servers_per_group: int) -> dict:
+    servers = [("java", server) for server in fake_servers.java.values()]
+    servers += [("bedrock", server) for server in fake_servers.bedrock.values()]
+    group_config = {}
+    for group_id in range(groups):
+        group_config[str(100000 + group_id)] = {
+            "enable": True,
+            "enable_query": True,
+            "enable_check": True,
+            "servers": [
+                {
+                    "name": f"{server_type}-{server.host}",
+                    "host": server.host,
+                    "port": fake_servers.java_port if server_type == "java" else fake_servers.bedrock_port,
+                    "type": server_type,
+                }
+                for server_type, server in random.sample(servers, min(servers_per_group, len(servers)))
+            ],
+        }
+    return {"enable": True, "bots": {bot_id: {"enable": True, "groups": group_config}}}
+
+
+def load_plugin(work_path: str, plugin_config: dict):
+    """
+    在临时目录中初始化 NoneBot 并加载插件
+    """
+    os.chdir(work_path)
+    os.symlink(PLUGIN_PATH, os.path.join(work_path, PLUGIN_NAME))
+    sys.path.insert(0, work_path)
+    nonebot.init(driver="~none", log_level="WARNING", **plugin_config)
+    return nonebot.load_plugin(PLUGIN_NAME).module  # type: ignore
+
+
+async def wait_dispatcher(plugin):
+    dispatcher = plugin.message_dispatcher
+    while dispatcher.qsize() or dispatcher.workers:
+        await asyncio.sleep(0.01)
+
+
+async def run(args, plugin, fake_servers: FakeServers, bot: StubBot) -> dict:
+    servers_map = plugin.servers_data.servers_map
+    sampler = FDSampler()
+    sampler.start()
+    report = {}
+
+    # 定时查询
+    cycle_times = []
+    notifications = 0
+    for cycle in range(args.cycles):
+        if cycle:
+            for server in random.sample(fake_servers.servers(), int(len(fake_servers.servers()) * args.flap)):
+                server.online = not server.online
+        for server in servers_map.servers.values():
+            server.next_query_time = 0
+        bot.calls = 0
+        start_time = time.perf_counter()
+        await plugin.queryServerStatusChanged()
+        cycle_times.append(time.perf_counter() - start_time)
+        await wait_dispatcher(plugin)
+        notifications += bot.calls
+    report["cycle"] = timing_report(cycle_times, len(servers_map.servers))
+    report["cycle"]["notifications"] = notifications
+
+    # 群聊查询
+    query_times = []
+    for group in list(servers_map.groups.values()):
+        event = SimpleNamespace(group_id=int(group.group_id))
+        start_time = time.perf_counter()
+        await plugin.query_group(bot, event)
+        query_times.append(time.perf_counter() - start_time)
+    report["query_group"] = timing_report(query_times, 1)
+
+    # 消息格式化
+    subscriptions = [subscription for group in servers_map.groups.values() for subscription in group.subscriptions]
+    statuses = {}
+    for subscription in subscriptions:
+        statuses[subscription.server.key] = plugin.data.status_cache.get(subscription.server.key, float("inf"))[1]
+    format_times = []
+    for _ in range(args.format_rounds):
+        start_time = time.perf_counter()
+        for subscription in subscriptions:
+            format_data = servers_map.get_format_data(subscription)
+            servers_map.format_server_message(statuses[subscription.server.key], format_data)
+        format_times.append(time.perf_counter() - start_time)
+    report["format_server_message"] = timing_report(format_times, len(subscriptions))
+
+    sampler.stop()
+    report["peak_fds"] = sampler.peak
+    report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report["fake_server_requests"] = fake_servers.requests
+    return report
+
+
+async def main(args, plugin, fake_servers: FakeServers, bot: StubBot):
+    await fake_servers.start()
+    try:
+        return await run(args, plugin, fake_servers, bot)
+    finally:
+        await fake_servers.stop()
+        await plugin.status_history.close()
+
+
+def print_report(report: dict):
+    for name in ("cycle", "query_group", "format_server_message"):
+        item = report[name]
+        line = f"{name:<24} p50 {item['p50_ms']:9.2f}ms  p99 {item['p99_ms']:9.2f}ms  {item['throughput_per_s']:10.1f}/s"
+        if "notifications" in item:
+            line += f"  通知 {item['notifications']}"
+        print(line)
+    print(f"峰值文件描述符 {report['peak_fds']}  峰值内存 {report['peak_rss_mb']:.1f}MB")
+    print(f"模拟服务器收到请求 {report['fake_server_requests']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--java", type=int, default=1000, help="JAVA服务器数量")
+    parser.add_argument("--bedrock", type=int, default=500, help="基岩服务器数量")
+    parser.add_argument("--groups", type=int, default=200, help="群聊数量")
+    parser.add_argument("--servers-per-group", type=int, default=10, help="每个群聊添加的服务器数量")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务器响应延迟(秒)")
+    parser.add_argument("--loss", type=float, default=0.0, help="模拟服务器丢包概率")
+    parser.add_argument("--hang", type=float, default=0.0, help="连接后不响应的服务器比例")
+    parser.add_argument("--favicon-size", type=int, default=8192, help="JAVA服务器图标大小(字节)")
+    parser.add_argument("--players", type=int, default=20, help="每个服务器的在线人数")
+    parser.add_argument("--flap", type=float, default=0.05, help="每轮之间改变在线状态的服务器比例")
+    parser.add_argument("--cycles", type=int, default=5, help="定时查询轮数")
+    parser.add_argument("--format-rounds", type=int, default=5, help="消息格式化轮数")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="模拟 OneBot API 调用延迟(秒)")
+    parser.add_argument("--java-port", type=int, default=25565)
+    parser.add_argument("--bedrock-port", type=int, default=19132)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="以JSON格式保存结果的文件")
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=VALUE", help="插件配置,可多次指定")
+    args = parser.parse_args()
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    random.seed(args.seed)
+    options = FakeServerOptions(args.latency, args.loss, args.hang, args.favicon_size, args.players)
+    fake_servers = FakeServers(args.java, args.bedrock, options, args.java_port, args.bedrock_port)
+    bot = StubBot("10000", args.api_latency)
+
+    work_path = tempfile.mkdtemp(prefix="mcquery-bench-")
+    os.makedirs(os.path.join(work_path, "mcQuery"))
+    with open(os.path.join(work_path, "mcQuery", "config_data.json"), "w", encoding="utf-8") as f:
+        json.dump(create_config_data(fake_servers, bot.self_id, args.groups, args.servers_per_group), f)
+
+    plugin_config = {
+        # 每轮都重新查询,不使用缓存
+        "QueryCacheTTL": 0,
+        "QueryMetricsPath": "",
+        "QuerySendMergeWindow": 0,
+        "QuerySendInterval": 0,
+    }
+    for item in args.config:
+        key, value = item.split("=", 1)
+        plugin_config[key] = value
+    plugin = load_plugin(work_path, plugin_config)
+    nonebot.get_driver()._bots[bot.self_id] = bot  # type: ignore
+
+    report = asyncio.run(main(args, plugin, fake_servers, bot))
+    report["args"] = vars(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
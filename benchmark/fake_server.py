@@ -0,0 +1,171 @@
+"""
+本地模拟的 Minecraft 服务器
+所有 JAVA 服务器共用一个TCP监听端口,所有基岩服务器共用一个UDP端口
+不同的服务器使用 127.0.0.0/8 中不同的地址区分(仅支持Linux)
+"""
+import asyncio
+import base64
+import json
+import random
+import socket
+import struct
+from dataclasses import dataclass, field
+
+# Linux 中 IP_PKTINFO 的值, socket 模块未导出
+IP_PKTINFO = getattr(socket, "IP_PKTINFO", 8)
+RAKNET_MAGIC = bytes.fromhex("00ffff00fefefefefdfdfdfd12345678")
+
+
+@dataclass
+class FakeServerOptions:
+    latency: float = 0.0  # 响应延迟(秒)
+    loss: float = 0.0  # 丢包(JAVA为断开连接)概率
+    hang: float = 0.0  # 连接后不响应的服务器比例
+    favicon_size: int = 0  # 图标大小(字节)
+    players: int = 20  # 在线人数(JAVA同时作为玩家列表长度)
+
+
+@dataclass
+class FakeServer:
+    host: str
+    online: bool = True
+    hang: bool = False
+    players: list[str] = field(default_factory=list)
+
+
+def host_of(index: int) -> str:
+    """
+    第 index 个服务器的地址,从 127.0.1.0 开始
+    """
+    index += 256
+    return f"127.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+
+
+def write_varint(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        result.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(result)
+
+
+async def read_varint(reader: asyncio.StreamReader) -> int:
+    value = 0
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value
+    raise IOError("varint 过长")
+
+
+class FakeServers:
+    """
+    一组模拟服务器及其运行统计
+    """
+
+    def __init__(self, java_count: int, bedrock_count: int, options: FakeServerOptions, java_port=25565, bedrock_port=19132):
+        self.options = options
+        self.java_port = java_port
+        self.bedrock_port = bedrock_port
+        self.java = {}  # type: dict[str, FakeServer]
+        self.bedrock = {}  # type: dict[str, FakeServer]
+        for i in range(java_count + bedrock_count):
+            server = FakeServer(host_of(i), hang=random.random() < options.hang)
+            server.players = [f"player{n}" for n in range(options.players)]
+            (self.java if i < java_count else self.bedrock)[server.host] = server
+        favicon = base64.b64encode(random.randbytes(options.favicon_size)).decode()
+        self.favicon = f"data:image/png;base64,{favicon}" if options.favicon_size else None
+        self.requests = {"java": 0, "bedrock": 0}
+        self.tcp_server = None  # type: asyncio.AbstractServer | None
+        self.udp_socket = None  # type: socket.socket | None
+
+    def servers(self):
+        return [*self.java.values(), *self.bedrock.values()]
+
+    async def start(self):
+        self.tcp_server = await asyncio.start_server(self._handle_java, "0.0.0.0", self.java_port, backlog=4096)
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.setsockopt(socket.SOL_IP, IP_PKTINFO, 1)
+        self.udp_socket.bind(("0.0.0.0", self.bedrock_port))
+        self.udp_socket.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.udp_socket, self._handle_bedrock)
+
+    async def stop(self):
+        if self.tcp_server is not None:
+            self.tcp_server.close()
+        if self.udp_socket is not None:
+            asyncio.get_running_loop().remove_reader(self.udp_socket)
+            self.udp_socket.close()
+
+    def java_status(self, server: FakeServer) -> bytes:
+        status = {
+            "version": {"name": "1.20.1", "protocol": 763},
+            "players": {
+                "online": len(server.players),
+                "max": 100,
+                "sample": [
+                    {"name": name, "id": f"00000000-0000-0000-0000-{n:012d}"}
+                    for n, name in enumerate(server.players)
+                ],
+            },
+            "description": {"text": "Benchmark server"},
+        }
+        if self.favicon is not None:
+            status["favicon"] = self.favicon
+        data = json.dumps(status).encode()
+        packet = write_varint(0) + write_varint(len(data)) + data
+        return write_varint(len(packet)) + packet
+
+    async def _handle_java(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.requests["java"] += 1
+        server = self.java.get(writer.get_extra_info("sockname")[0])
+        try:
+            if server is None or not server.online or random.random() < self.options.loss:
+                return
+            if server.hang:
+                await reader.read()
+                return
+            while True:
+                length = await read_varint(reader)
+                packet = await reader.readexactly(length)
+                if packet[0] == 0 and len(packet) > 1:
+                    # 握手
+                    continue
+                await asyncio.sleep(self.options.latency)
+                if packet[0] == 0:
+                    writer.write(self.java_status(server))
+                else:
+                    # ping
+                    writer.write(write_varint(len(packet)) + packet)
+                await writer.drain()
+        except (IOError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _handle_bedrock(self):
+        assert self.udp_socket is not None
+        try:
+            data, ancdata, flags, address = self.udp_socket.recvmsg(2048, socket.CMSG_SPACE(12))
+        except BlockingIOError:
+            return
+        self.requests["bedrock"] += 1
+        host = None
+        for level, type, cdata in ancdata:
+            if level == socket.SOL_IP and type == IP_PKTINFO:
+                host = socket.inet_ntoa(cdata[8:12])
+        server = self.bedrock.get(host)  # type: ignore
+        if server is None or server.hang or not server.online or random.random() < self.options.loss:
+            return
+        motd = f"MCPE;Benchmark server;594;1.20.0;{len(server.players)};100;0;world;Survival;".encode()
+        response = b"\x1c" + data[1:9] + b"\x00" * 8 + RAKNET_MAGIC + struct.pack(">H", len(motd)) + motd
+        # 以客户端请求的地址作为源地址回复
+        pktinfo = struct.pack("I4s4s", 0, socket.inet_aton(host), b"\x00" * 4)  # type: ignore
+        reply = lambda: self.udp_socket.sendmsg([response], [(socket.SOL_IP, IP_PKTINFO, pktinfo)], 0, address)  # type: ignore
+        if self.options.latency:
+            asyncio.get_running_loop().call_later(self.options.latency, reply)
+        else:
+            reply()
@@ -1,8 +1,53 @@
+from typing import Literal
+
 from pydantic import BaseModel, Extra
 
 
 class Config(BaseModel, extra=Extra.ignore):
     QueryInterval: int = 15
+    QueryIntervalMin: float = 5
+    QueryIntervalMax: float = 60
+    QueryIntervalMaxOffline: float = 300
+    QueryBackoff: float = 1.05
+    QueryBreakerThreshold: int = 20
+    QueryBreakerInterval: float = 600
+    QueryBreakerMaxInterval: float = 86400
+    QueryTick: float = 1
+    QueryCacheTTL: float = 10
+    QueryCacheSize: int = 1024
+    QueryFaviconCacheSize: int = 256
+    QueryRenderCacheSize: int = 4096
+    QueryConcurrency: int = 64
+    QueryTimeout: float = 3
+    QueryCycleTimeout: float | None = None
+    QueryProbeMode: Literal["status", "ping", "tcp"] = "status"
+    QueryWorkers: int = 0
+    QueryFastStatus: bool = True
+    QueryStaleReply: bool = False
+    QueryReplyDeadline: float | None = None
+    QueryReplyLateMode: Literal["followup", "timeout"] = "followup"
+    QueryPlayerNotify: bool = False
+    QueryPlayerNotifyNames: int = 10
+    QueryServerCacheSize: int = 256
+    QueryServerCacheTTL: float = 15
+    QueryServerNegativeTTL: float = 30
+    QueryServerRate: float = 6
+    QueryServerBurst: int = 3
+    QueryServerGroupConcurrency: int = 1
+    QueryServerConcurrency: int = 8
+    QueryServerGlobalRate: float = 60
+    QueryServerGlobalBurst: int = 10
+    QueryDnsMinTTL: float = 30
+    QueryDnsMaxTTL: float = 3600
+    QueryDnsNegativeTTL: float = 60
+    QuerySendMergeWindow: float = 5
+    QuerySendInterval: float = 1
+    QuerySendRetries: int = 3
+    QuerySendRetryDelay: float = 2
+    QuerySaveDelay: float = 1
+    QueryConfigWatchInterval: float = 5
+    QueryHistory: bool = True
+    QueryMetricsPath: str = "/mcquery/metrics"
 
     class format:
         server_title = (
@@ -25,6 +70,10 @@ class Config(BaseModel, extra=Extra.ignore):
             "服务器ip: {server_host}:{server_port}\n"
             "服务器离线\n"
         )
+        server_timeout = (
+            "服务器ip: {server_host}:{server_port}\n"
+            "查询超时\n"
+        )
 
         server_state_change_online = (
             "服务器: {server_name}({server_host}:{server_port} {server_type}) 状态改变 离线=>在线"
@@ -34,12 +83,56 @@ class Config(BaseModel, extra=Extra.ignore):
             "服务器: {server_name}({server_host}:{server_port} {server_type}) 状态改变 在线=>离线"
         )
 
+        server_players_join = (
+            "服务器: {server_name} 玩家加入: {players}"
+        )
+
+        server_players_leave = (
+            "服务器: {server_name} 玩家离开: {players}"
+        )
+
         group_start_query = (
             "查询中..."
         )
+        group_status_age = (
+            "(状态为{age}秒前的查询结果)"
+        )
+        group_status_updated = (
+            "=== 服务器状态已更新 ==="
+        )
+        group_query_late = (
+            "=== 查询较慢的服务器 ==="
+        )
         group_no_servers = (
             "群聊未添加服务器"
         )
+        group_server_not_found = (
+            "服务器不存在"
+        )
+        group_history = (
+            "=== {server_name} 最近一{period} ===\n"
+            "在线率: {uptime:.1f}%\n"
+            "平均在线人数: {players_avg}\n"
+            "最高在线人数: {players_max}\n"
+            "平均延迟: {latency_avg}ms"
+        )
+        group_history_empty = (
+            "暂无历史记录"
+        )
+        group_statistics = (
+            "=== 运行统计 ===\n"
+            "监测服务器: {servers}\n"
+            "查询轮数: {cycles} 平均耗时: {cycle_avg}ms\n"
+            "单次查询耗时 p50: {probe_p50}ms p99: {probe_p99}ms\n"
+            "最慢的服务器: {slow_servers}\n"
+            "查询失败: {errors}\n"
+            "超时未完成: {unknown}\n"
+            "待发送通知: {queue_depth}\n"
+            "缓存命中率 状态: {status_hit_rate} 图标: {favicon_hit_rate} DNS: {dns_hit_rate} 消息: {render_hit_rate}"
+        )
+        group_query_too_frequent = (
+            "查询过于频繁,请稍后再试"
+        )
         group_server_type_error = (
             "服务器类型错误,应当为\"java\"或\"bedrock\""
         )
@@ -1,59 +1,283 @@
 import json
+import asyncio
 import os
+import time
+import random
 import hashlib
-import base64
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import NamedTuple, Mapping
 
-from nonebot import get_driver
-from nonebot.adapters.onebot.v11 import Message, MessageSegment
+from nonebot import get_driver, get_bots
+from nonebot.log import logger
+from nonebot.adapters.onebot.v11 import MessageSegment
 import mcstatus
-
-
+from mcstatus.address import Address
+from mcstatus.pinger import AsyncServerPinger
+from mcstatus.protocol.connection import TCPAsyncSocketConnection
+
+from .resolver import resolver
+from .bedrock import BedrockProber
+from .status import JavaStatus, read_status, decode_favicon
+from .template import templates, render_cache, MessageRenderer
+from .metrics import metrics
 from .config import Config
 global_config = get_driver().config
 plugin_config = Config.parse_obj(global_config)
 
 
+class StatusCache:
+    """
+    服务器状态缓存
+    按服务器地址缓存最近一次查询结果,超过容量时淘汰最久未使用的条目
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.data = OrderedDict()  # type: OrderedDict[tuple[str, str, int], tuple[float, mcstatus.pinger.PingResponse | mcstatus.bedrock_status.BedrockStatusResponse | None]]
+
+    def get(self, server_key: tuple[str, str, int], ttl: float | None = None, negative_ttl: float | None = None):
+        """
+        获取缓存的状态
+        negative_ttl 为离线结果的有效期,默认与 ttl 相同
+        返回 (是否命中, 状态)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if not server_key in self.data:
+            return False, None
+        update_time, status = self.data[server_key]
+        if status is None and negative_ttl is not None:
+            ttl = negative_ttl
+        if time.monotonic() - update_time > ttl:
+            return False, None
+        self.data.move_to_end(server_key)
+        return True, status
+
+    def peek(self, server_key: tuple[str, str, int]):
+        """
+        获取最近一次查询结果,不论是否过期
+        返回 (查询时间, 状态), 没有查询过时返回 None
+        """
+        return self.data.get(server_key)
+
+    def set(self, server_key: tuple[str, str, int], status):
+        self.data[server_key] = (time.monotonic(), status)
+        self.data.move_to_end(server_key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+
+status_cache = StatusCache(plugin_config.QueryCacheTTL, plugin_config.QueryCacheSize)
+# 正在进行的查询 同一服务器的并发查询共用一个任务
+querying_tasks = {}  # type: dict[tuple[str, str, int], asyncio.Task]
+# 限制同时进行的查询数量
+query_semaphore = asyncio.Semaphore(plugin_config.QueryConcurrency)
+
+
+class FaviconCache:
+    """
+    服务器图标缓存
+    按图标内容的hash缓存图片消息段,图标未改变时无需重新解码和编码
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.data = OrderedDict()  # type: OrderedDict[bytes, MessageSegment]
+
+    def get(self, favicon: str | bytes | None):
+        """
+        获取图标对应的图片消息段
+        favicon 也可以是 JavaStatus 中未解码的原始字节
+        服务器没有图标时返回空字符串
+        """
+        if not favicon:
+            return ""
+        key = hashlib.sha1(favicon if isinstance(favicon, bytes) else favicon.encode()).digest()
+        if key in self.data:
+            metrics.cache_requests.inc("favicon", "hit")
+            self.data.move_to_end(key)
+            return self.data[key]
+        metrics.cache_requests.inc("favicon", "miss")
+        if isinstance(favicon, bytes):
+            favicon = decode_favicon(favicon)
+        # 图标本身就是base64编码,直接使用无需解码
+        segment = MessageSegment.image(f"base64://{favicon.split(',', 1)[-1]}")
+        self.data[key] = segment
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+        return segment
+
+
+favicon_cache = FaviconCache(plugin_config.QueryFaviconCacheSize)
+bedrock_prober = BedrockProber(plugin_config.QueryTimeout)
+
+
+# 隐藏玩家列表的服务器返回的匿名玩家
+ANONYMOUS_PLAYER_ID = "00000000-0000-0000-0000-000000000000"
+
+
 class Server:
     """
     服务器类
     提供查询服务器状态,判断服务器在线状态是否改变等功能
     """
 
+    __slots__ = ("type", "host", "port", "key", "address", "last_online_status", "query_interval", "next_query_time", "players", "failures", "probe_duration")
+
     def __init__(self, type: str, host: str, port: int, **argv):
         self.type = type.lower()
         self.host = host
         self.port = port
+        # 同一地址可能同时运行JAVA和基岩服务器,按类型区分
+        self.key = (self.type, host, port)
         assert self.type in ["java", "bedrock"]
-        if self.type == "java":
-            self.server = mcstatus.JavaServer(self.host, self.port)
-        elif self.type == "bedrock":
-            self.server = mcstatus.BedrockServer(self.host, self.port)
+        self.address = Address(self.host, self.port)
 
         self.last_online_status = None
-
-    async def status(self):
+        # 上次查询的 (在线人数, {UUID的hash: 玩家名称}), 玩家列表不完整时只记录人数
+        self.players = None  # type: tuple[int, dict[int, str] | None] | None
+        # 自适应查询间隔 首次查询时间在一个周期内随机分布
+        self.query_interval = plugin_config.QueryInterval
+        self.next_query_time = time.monotonic() + random.uniform(0, plugin_config.QueryInterval)
+        # 连续离线次数 达到 QueryBreakerThreshold 后熔断
+        self.failures = 0
+        # 查询耗时的指数移动平均(秒)
+        self.probe_duration = None  # type: float | None
+
+    async def status(self, cache_ttl: float | None = None, negative_ttl: float | None = None):
         """
         获取服务器状态
+        缓存未过期时直接返回缓存结果, cache_ttl 为 0 时强制查询
         """
-        try:
-            return await self.server.async_status()
-        except:
-            return None
+        hit, status = status_cache.get(self.key, cache_ttl, negative_ttl)
+        metrics.cache_requests.inc("status", "hit" if hit else "miss")
+        if hit:
+            return status
+        task = querying_tasks.get(self.key)
+        if task is None:
+            task = asyncio.create_task(self._query_status())
+            querying_tasks[self.key] = task
+            task.add_done_callback(lambda _: querying_tasks.pop(self.key, None))
+        # 防止单个调用者被取消时中断共用的查询
+        return await asyncio.shield(task)
+
+    async def _query_status(self):
+        """
+        查询服务器状态并写入缓存
+        超过 QueryTimeout 未响应视为离线
+        """
+        async with query_semaphore:
+            start_time = time.monotonic()
+            try:
+                status = await asyncio.wait_for(self._status(), plugin_config.QueryTimeout)
+            except asyncio.TimeoutError:
+                logger.debug(f"查询服务器: {self.host}:{self.port} 超时")
+                metrics.probe_errors.inc(self.type, "Timeout")
+                status = None
+            except Exception as e:
+                logger.debug(f"查询服务器: {self.host}:{self.port} 失败 {type(e).__name__}: {e}")
+                metrics.probe_errors.inc(self.type, type(e).__name__)
+                status = None
+            self.record_probe_duration(time.monotonic() - start_time)
+            metrics.probe_duration.observe(time.monotonic() - start_time, self.type, "status")
+        status_cache.set(self.key, status)
+        return status
+
+    async def probe(self, cache_ttl: float | None = None):
+        """
+        探测服务器是否在线
+        按 QueryProbeMode 选择探测方式:
+            status  完整状态查询
+            ping    JAVA服务器只进行握手和ping,不请求状态
+            tcp     JAVA服务器只建立TCP连接
+        基岩服务器的状态查询本身只有一次无连接ping,始终使用完整状态查询
+        返回 (是否在线, 状态), 只探测了在线状态时状态为 None
+        """
+        if self.type == "bedrock" or plugin_config.QueryProbeMode == "status":
+            status = await self.status(cache_ttl)
+            return status is not None, status
+        hit, status = status_cache.get(self.key, cache_ttl)
+        metrics.cache_requests.inc("status", "hit" if hit else "miss")
+        if hit:
+            return status is not None, status
+        async with query_semaphore:
+            start_time = time.monotonic()
+            try:
+                await asyncio.wait_for(self._probe(), plugin_config.QueryTimeout)
+            except asyncio.TimeoutError:
+                logger.debug(f"探测服务器: {self.host}:{self.port} 超时")
+                metrics.probe_errors.inc(self.type, "Timeout")
+                return False, None
+            except Exception as e:
+                logger.debug(f"探测服务器: {self.host}:{self.port} 失败 {type(e).__name__}: {e}")
+                metrics.probe_errors.inc(self.type, type(e).__name__)
+                return False, None
+            finally:
+                self.record_probe_duration(time.monotonic() - start_time)
+                metrics.probe_duration.observe(time.monotonic() - start_time, self.type, plugin_config.QueryProbeMode)
+        return True, None
+
+    async def _status(self):
+        """
+        通过缓存的域名解析结果连接服务器并获取状态
+        JAVA服务器握手时仍使用原域名,以兼容按域名转发的代理
+        """
+        ip = await resolver.resolve(self.host)
+        if self.type == "bedrock":
+            return await bedrock_prober.status(ip, self.port)
+        ip_address = Address(ip, self.port)
+        async with TCPAsyncSocketConnection(ip_address, plugin_config.QueryTimeout) as connection:
+            pinger = AsyncServerPinger(connection, address=self.address)
+            pinger.handshake()
+            if plugin_config.QueryFastStatus:
+                # 只解析消息模板用到的字段
+                return await read_status(pinger, "server_favicon" in templates.server_java.fields, plugin_config.QueryPlayerNotify)
+            return await pinger.read_status()
+
+    async def _probe(self):
+        ip = await resolver.resolve(self.host)
+        if plugin_config.QueryProbeMode == "tcp":
+            reader, writer = await asyncio.open_connection(ip, self.port)
+            writer.close()
+            await writer.wait_closed()
+        else:
+            async with TCPAsyncSocketConnection(Address(ip, self.port), plugin_config.QueryTimeout) as connection:
+                pinger = AsyncServerPinger(connection, address=self.address)
+                pinger.handshake()
+                await pinger.test_ping()
 
-    async def get_online_status(self):
+    def record_probe_duration(self, duration: float):
         """
-        获取在线状态
+        记录一次查询耗时,超时的查询按实际等待时间计入
         """
-        if await self.status() is None:
-            return "offline"
+        if self.probe_duration is None:
+            self.probe_duration = duration
         else:
+            self.probe_duration += (duration - self.probe_duration) * 0.3
+
+    async def get_online_status(self, cache_ttl: float | None = None):
+        """
+        获取在线状态
+        """
+        online, _ = await self.probe(cache_ttl)
+        if online:
             return "online"
+        else:
+            return "offline"
 
     async def is_online_status_changed(self):
         """
         在线状态是否改变
+        返回 (在线状态改变结果, 本次查询得到的状态), 只探测了在线状态时状态为 None
+        """
+        online, status = await self.probe(min(status_cache.ttl, self.query_interval / 2))
+        return self.set_online_status("online" if online else "offline"), status
+
+    def set_online_status(self, online_status: str):
+        """
+        记录新的在线状态,在线状态改变时返回新的状态,否则返回 False
         """
-        online_status = await self.get_online_status()
         if online_status != self.last_online_status and not self.last_online_status is None:
             self.last_online_status = online_status
             return online_status
@@ -61,6 +285,77 @@ class Server:
             self.last_online_status = online_status
             return False
 
+    def update_players(self, online: int | None, sample: list | None = None):
+        """
+        记录在线玩家,返回与上次查询相比的变化 (加入的玩家, 离开的玩家, 加入人数, 离开人数)
+        JAVA服务器的玩家列表完整时按UUID对比,否则(基岩服务器或在线人数超过列表长度)只对比人数
+        首次查询、服务器离线或没有变化时返回 None
+        """
+        last = self.players
+        if online is None:
+            self.players = None
+            return None
+        players = None
+        if sample is not None and len(sample) == online:
+            players = {hash(player.id): player.name for player in sample if player.id != ANONYMOUS_PLAYER_ID}
+        self.players = (online, players)
+        if last is None:
+            return None
+        last_online, last_players = last
+        if players is not None and last_players is not None:
+            joined = [players[key] for key in players.keys() - last_players.keys()]
+            left = [last_players[key] for key in last_players.keys() - players.keys()]
+            if not joined and not left:
+                return None
+            return joined, left, len(joined), len(left)
+        if online == last_online:
+            return None
+        return [], [], max(online - last_online, 0), max(last_online - online, 0)
+
+    def update_query_time(self, changed: bool, start_time: float):
+        """
+        根据在线状态是否改变调整查询间隔
+        状态刚改变时缩短间隔,状态稳定后逐渐延长,长期离线的服务器间隔上限更高
+        连续离线达到 QueryBreakerThreshold 次后熔断,改为低频探测并按指数延长间隔
+        """
+        if self.last_online_status == "offline":
+            self.failures += 1
+        else:
+            self.failures = 0
+        if self.breaker_open():
+            if self.failures == plugin_config.QueryBreakerThreshold:
+                self.query_interval = plugin_config.QueryBreakerInterval
+            else:
+                self.query_interval = min(self.query_interval * 2, plugin_config.QueryBreakerMaxInterval)
+        elif changed:
+            self.query_interval = plugin_config.QueryIntervalMin
+        else:
+            if self.last_online_status == "offline":
+                max_interval = plugin_config.QueryIntervalMaxOffline
+            else:
+                max_interval = plugin_config.QueryIntervalMax
+            self.query_interval = min(self.query_interval * plugin_config.QueryBackoff, max_interval)
+        self.next_query_time = start_time + self.query_interval * random.uniform(0.9, 1.1)
+
+    def breaker_open(self) -> bool:
+        return 0 < plugin_config.QueryBreakerThreshold <= self.failures
+
+    def reset_breaker(self):
+        """
+        用户主动查询时解除熔断,恢复正常查询间隔
+        """
+        if self.breaker_open():
+            self.query_interval = plugin_config.QueryIntervalMin
+            self.next_query_time = min(self.next_query_time, time.monotonic() + self.query_interval)
+        self.failures = 0
+
+    def breaker_state(self) -> dict:
+        return {
+            "state": "open" if self.breaker_open() else "closed",
+            "failures": self.failures,
+            "next_query": max(0, round(self.next_query_time - time.monotonic())),
+        }
+
     # def get_format_dict(self):
     #     return {
     #         "server_name": self.name,
@@ -131,119 +426,263 @@ class Server:
     #         ).format(**format_data)
 
 
-class ServersMap:
-    data = {
-        "SERVER_HASH": {
-            "bot_groups": {
-                "BOT_GROUP_KEY": {
-                    "data": {},
-                }
-            },
-            "server": "Server(...)"
-        }
-    }
+class AdhocServers:
+    """
+    自定义查询的服务器
+    保留最近查询过的服务器,重复查询同一地址时复用,超过容量时淘汰最久未使用的服务器
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.data = OrderedDict()  # type: OrderedDict[tuple[str, str, int], Server]
+
+    def get(self, type: str, host: str, port: int) -> Server:
+        key = (type.lower(), host, port)
+        server = self.data.get(key)
+        if server is None:
+            server = Server(type, host, port)
+            self.data[key] = server
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+        else:
+            self.data.move_to_end(key)
+        return server
+
+
+adhoc_servers = AdhocServers(plugin_config.QueryServerCacheSize)
+
+
+class Group:
+    """
+    群聊订阅记录
+    enable 为全局、机器人、群聊三级开关合并后的结果,在加载时计算
+    """
+    __slots__ = ("bot_id", "group_id", "enable", "enable_query", "enable_check", "enable_players", "subscriptions")
+
+    def __init__(self, bot_id: str, group_id: str, group_data: dict):
+        self.bot_id = bot_id
+        self.group_id = group_id
+        self.enable = group_data["enable"]  # type: bool
+        self.enable_query = group_data["enable_query"]  # type: bool
+        self.enable_check = group_data["enable_check"]  # type: bool
+        self.enable_players = group_data.get("enable_players", False)  # type: bool
+        self.subscriptions = []  # type: list[Subscription]
 
-    loading = False
+
+class Subscription:
+    """
+    群聊中添加的服务器
+    """
+    __slots__ = ("group", "server", "name", "type", "host", "port")
+
+    def __init__(self, group: Group, server: Server, server_data: dict):
+        self.group = group
+        self.server = server
+        self.name = server_data["name"]  # type: str
+        self.type = server_data["type"]  # type: str
+        self.host = server_data["host"]  # type: str
+        self.port = server_data["port"]  # type: int
+
+
+class FanoutTarget(NamedTuple):
+    """
+    接收通知的群聊,消息格式化使用的字段在构建时绑定
+    """
+    bot_id: str
+    group_id: str
+    format_data: Mapping[str, object]
+
+
+class Fanout(NamedTuple):
+    """
+    服务器的通知对象,只包含已启用且机器人在线的群聊
+    """
+    check: tuple[FanoutTarget, ...]
+    players: tuple[FanoutTarget, ...]
+
+
+class ServersMap:
+    #
+    #   servers:        (type, host, port)  -> Server
+    #   subscribers:    (type, host, port)  -> {(bot_id, group_id): Subscription}
+    #   groups:         (bot_id, group_id)  -> Group
+    #                                           └─ subscriptions: [Subscription, ...]
+    #   fanouts:        (type, host, port)  -> Fanout (按需构建,配置或在线机器人改变时清空)
+    #
+    # 同一群聊重复添加同一服务器时, subscribers 中只记录第一个
 
     def __init__(self, parent):
         self.parent = parent
+        self.servers = {}  # type: dict[tuple[str, str, int], Server]
+        self.subscribers = {}  # type: dict[tuple[str, str, int], dict[tuple[str, str], Subscription]]
+        self.groups = {}  # type: dict[tuple[str, str], Group]
+        self.fanouts = {}  # type: dict[tuple[str, str, int], Fanout]
 
     def load_data(self, config_data):
-        self.loading = True
-        self.data = {}
+        """
+        按配置重建所有订阅
+        仍被订阅的服务器保留原有的 Server 对象和在线状态
+        """
+        old_servers = self.servers
+        self.servers = {}
+        self.subscribers = {}
+        self.groups = {}
+        self.fanouts = {}
         for bot_id in config_data["bots"]:
             for group_id in config_data["bots"][bot_id]["groups"]:
-                for server_data in config_data["bots"][bot_id]["groups"][group_id]["servers"]:
-                    self.add_server(bot_id, group_id, server_data)
-        self.loading = False
-
-    def reload_data(self, config_data):
-        self.data = {} # 清空配置
-        temp_data = self.data.copy()
-        self.load_data(config_data)
-        self.loading = True
-        # 同步服务器状态
-        for server_hash in self.data:
-            if server_hash in temp_data:
-                self.data[server_hash]["server"] = temp_data[server_hash]["server"]
-        self.loading = False
-
-    def add_server(self, bot_id, group_id, server_data):
-        server_hash = hashlib.sha256(f"{server_data['host']}:{server_data['port']}".encode()).hexdigest()
-        bot_group_key = f"{bot_id} {group_id}"
-        self.loading = True
-        if not server_hash in self.data:
-            self.data[server_hash] = {
-                "bot_groups": {},
-                "server": Server(**server_data)
-            }
-            #
-            #   {
-            # ┃     "SERVER_HASH": {
-            # ┃         "bot_groups":{
-            #               "BOT_GROUP_HASH": {
-            #                   ...data...
-            #               }
-            # ┃         },
-            # ┃         "server": Server(...)
-            # ┃     }
-            #   }
-            #
-
-        if not bot_group_key in self.data[server_hash]["bot_groups"]:
-            self.data[server_hash]["bot_groups"][bot_group_key] = {
-                "enable": self.parent.get_group_data(bot_id, group_id)["enable"],
-                "enable_query": self.parent.get_group_data(bot_id, group_id)["enable_query"],
-                "enable_check": self.parent.get_group_data(bot_id, group_id)["enable_check"],
-                **server_data
-            }
-            #
-            #   {
-            #       "SERVER_HASH": {
-            #           "bot_groups":{
-            # ┃             "BOT_GROUP_HASH": {
-            # ┃                 ...data...
-            # ┃             }
-            #           },
-            #           "server": Server(...)
-            #       }
-            #   }
-            #
-        self.loading = False
-        return True
+                self._add_group(bot_id, group_id, old_servers)
 
-    def remove_group_server(self, bot_id, group_id, server_data):
-        server_hash = hashlib.sha256(f"{server_data['host']}:{server_data['port']}".encode()).hexdigest()
-        self.loading = True
-        self.data[server_hash]["bot_groups"].pop(f"{bot_id} {group_id}")
-        self.loading = False
+    def reload_data(self, old_config_data, config_data):
+        """
+        对比新旧配置,只重建有改动的群聊
+        在群聊之间移动的服务器也保留原有的 Server 对象
+        """
+        old_servers = {}
+        old_bots = old_config_data.get("bots", {})
+        bots = config_data["bots"]
+        for bot_id in old_bots.keys() | bots.keys():
+            old_bot = old_bots.get(bot_id, {})
+            bot = bots.get(bot_id, {})
+            # 全局或机器人开关改变时,所有群聊的开关都需要重新计算
+            enable_changed = (
+                old_config_data.get("enable") != config_data.get("enable") or
+                old_bot.get("enable") != bot.get("enable")
+            )
+            old_groups = old_bot.get("groups", {})
+            groups = bot.get("groups", {})
+            for group_id in old_groups.keys() | groups.keys():
+                if enable_changed or old_groups.get(group_id) != groups.get(group_id):
+                    try:
+                        self.load_group(bot_id, group_id, old_servers)
+                    except ValueError as e:
+                        logger.warning(f"群聊 {group_id} 的配置格式错误,保留原有的订阅: {e}")
+
+    def load_group(self, bot_id, group_id, old_servers: dict[tuple[str, str, int], Server] | None = None):
+        """
+        按配置重建单个群聊的订阅
+        old_servers 用于暂存移除的服务器,以便之后重新订阅时复用
+        配置格式错误时抛出 ValueError,原有的订阅保持不变
+        """
+        old_servers = {} if old_servers is None else old_servers
+        exists = group_id in self.parent.config_data["bots"].get(bot_id, {}).get("groups", {})
+        if exists:
+            check_group_data(self.parent.get_group_data(bot_id, group_id))
+        self.clear_fanouts()
+        group = self.groups.get((bot_id, group_id))
+        if group is not None:
+            for subscription in group.subscriptions:
+                old_servers[subscription.server.key] = subscription.server
+                self._remove_subscription(subscription)
+            # 订阅全部移除后再移除群聊
+            self.groups.pop((bot_id, group_id))
+        if exists:
+            self._add_group(bot_id, group_id, old_servers)
+
+    def _add_group(self, bot_id, group_id, servers: dict[tuple[str, str, int], Server]):
+        group = Group(bot_id, group_id, self.parent.get_group_data(bot_id, group_id))
+        for server_data in group_data_servers(self.parent.config_data, bot_id, group_id):
+            key = (server_data["type"].lower(), server_data["host"], server_data["port"])
+            if not key in self.servers:
+                self.servers[key] = servers.get(key) or Server(**server_data)
+                self.subscribers[key] = {}
+            subscription = Subscription(group, self.servers[key], server_data)
+            group.subscriptions.append(subscription)
+            self.subscribers[key].setdefault((bot_id, group_id), subscription)
+        self.groups[(bot_id, group_id)] = group
+
+    def _remove_subscription(self, subscription: Subscription):
+        key = subscription.server.key
+        if not key in self.subscribers:
+            # 同一群聊重复添加的服务器,已随第一个订阅移除
+            return
+        group_key = (subscription.group.bot_id, subscription.group.group_id)
+        subscribers = self.subscribers[key]
+        if subscribers.get(group_key) is subscription:
+            subscribers.pop(group_key)
+        if not subscribers:
+            # 没有群聊订阅的服务器
+            self.subscribers.pop(key)
+            self.servers.pop(key, None)
+
+    def get_group(self, bot_id, group_id) -> Group | None:
+        return self.groups.get((bot_id, group_id))
+
+    def get_fanout(self, server_key: tuple[str, str, int]) -> Fanout:
+        """
+        获取服务器的通知对象
+        """
+        fanout = self.fanouts.get(server_key)
+        if fanout is None:
+            bots = get_bots()
+            check = []
+            players = []
+            for subscription in self.subscribers.get(server_key, {}).values():
+                group = subscription.group
+                if not group.enable or not group.bot_id in bots:
+                    # 群聊未启用或机器人不在线,跳过
+                    continue
+                target = FanoutTarget(group.bot_id, group.group_id, MappingProxyType(self.get_format_data(subscription)))
+                if group.enable_check:
+                    check.append(target)
+                if group.enable_players:
+                    players.append(target)
+            fanout = Fanout(tuple(check), tuple(players))
+            self.fanouts[server_key] = fanout
+        return fanout
+
+    def clear_fanouts(self):
+        """
+        配置或在线机器人改变后,通知对象需要重新构建
+        """
+        self.fanouts.clear()
 
-    def get_server(self, server_hash: str):
+    def get_format_data(self, subscription: Subscription):
         return {
-            "hash": server_hash,
-            **self.data[server_hash]
+            "server_name": subscription.name,
+            "server_type": subscription.type,
+            "server_host": subscription.host,
+            "server_port": subscription.port,
+            "bot_id": subscription.group.bot_id,
+            "group_id": subscription.group.group_id,
         }
 
-    def get_bot_group_data(self, server_hash, bot_id, group_id):
-        return self.get_server(server_hash)["bot_groups"][f"{bot_id} {group_id}"]
+    def create_server_message(self, subscription: Subscription, server_status: mcstatus.pinger.PingResponse | mcstatus.bedrock_status.BedrockStatusResponse | None):
+        """
+        获取服务器消息
+        """
+        format_data = self.get_format_data(subscription)
+        return self.render_server_message(subscription.server.key, server_status, format_data)
 
-    def get_format_data(self, server_hash, bot_id, group_id):
-        result = self.get_bot_group_data(server_hash, bot_id, group_id)
-        return {
-            "server_name": result["name"],
-            "server_type": result["type"],
-            "server_host": result["host"],
-            "server_port": result["port"],
-            "bot_id": bot_id,
-            "group_id": group_id,
-        }
+    def create_timeout_message(self, subscription: Subscription):
+        """
+        获取未在回复时限内查询完成的服务器消息
+        """
+        return templates.server_timeout.render(**self.get_format_data(subscription))
 
-    def create_server_message(self, server_hash, bot_id, group_id, server_status: mcstatus.pinger.PingResponse | mcstatus.bedrock_status.BedrockStatusResponse | None):
+    def render_server_message(self, server_key: tuple[str, str, int], server_status: mcstatus.pinger.PingResponse | mcstatus.bedrock_status.BedrockStatusResponse | None, format_data: dict):
         """
-        获取服务器消息
+        获取服务器消息,同一状态只渲染一次
+        返回的消息可能被多个群聊共用,不能修改
         """
-        format_data = self.get_format_data(server_hash, bot_id, group_id)
-        return self.format_server_message(server_status, format_data)
+        return render_cache.get(
+            self.get_server_template(format_data["server_type"], server_status),
+            server_key,
+            server_status,
+            format_data,
+            lambda: self.format_server_message(server_status, format_data)
+        )
+
+    def get_server_template(self, server_type: str, server_status) -> MessageRenderer:
+        """
+        服务器消息使用的模板
+        """
+        if server_status is None:
+            return templates.server_offline
+        if server_type == "java" and isinstance(server_status, mcstatus.pinger.PingResponse):
+            return templates.server_java
+        if server_type == "bedrock" and isinstance(server_status, mcstatus.bedrock_status.BedrockStatusResponse):
+            return templates.server_bedrock
+        return templates.server_error
 
     def format_server_message(self, server_status: mcstatus.pinger.PingResponse | mcstatus.bedrock_status.BedrockStatusResponse | None, format_data: dict):
         if not server_status is None:
@@ -255,18 +694,17 @@ class ServersMap:
             """
             服务器离线
             """
-            return Message.template(
-                f"{plugin_config.format.server_title}\n"
-                f"{plugin_config.format.server_offline}"
-            ).format(**format_data)
+            return templates.server_offline.render(**format_data)
         if format_data["server_type"] == "java" and not server_status is None:
             """
             JAVA服务器
             """
             assert isinstance(server_status, mcstatus.pinger.PingResponse)
             # 处理服务器图标
-            server_favicon_data = base64.b64decode(server_status.favicon.split(",")[1])  # type: ignore
-            format_data["server_favicon"] = MessageSegment.image(server_favicon_data)
+            if isinstance(server_status, JavaStatus):
+                format_data["server_favicon"] = favicon_cache.get(server_status.favicon_raw)
+            else:
+                format_data["server_favicon"] = favicon_cache.get(server_status.favicon)
             # 处理服务器版本
             format_data["server_version"] = server_status.version.name
             format_data["server_version_name"] = server_status.version.name
@@ -274,10 +712,7 @@ class ServersMap:
             # 处理玩家数量
             format_data["server_players_max"] = server_status.players.max
             format_data["server_players_online"] = server_status.players.online
-            return Message.template(
-                f"{plugin_config.format.server_title}\n"
-                f"{plugin_config.format.server_java_msg}"
-            ).format(**format_data)
+            return templates.server_java.render(**format_data)
         elif format_data["server_type"] == "bedrock" and not server_status is None:
             """
             基岩服务器
@@ -291,15 +726,45 @@ class ServersMap:
             format_data["server_players_max"] = server_status.players_max
             format_data["server_players_online"] = server_status.players_online
 
-            return Message.template(
-                f"{plugin_config.format.server_title}\n"
-                f"{plugin_config.format.server_bedrock_msg}"
-            ).format(**format_data)
+            return templates.server_bedrock.render(**format_data)
         else:
-            return Message.template(
-                f"{plugin_config.format.server_title}\n"
-                f"未知错误"
-            ).format(**format_data)
+            return templates.server_error.render(**format_data)
+
+
+def get_file_version(path: str):
+    """
+    以修改时间和大小判断文件是否改变
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def group_data_servers(config_data, bot_id, group_id) -> list[dict]:
+    return config_data["bots"][bot_id]["groups"][group_id]["servers"]
+
+
+def check_group_data(group_data: dict):
+    """
+    检查群聊配置能否用于建立订阅,格式错误时抛出 ValueError
+    """
+    for key in ["enable", "enable_query", "enable_check"]:
+        if not isinstance(group_data.get(key), bool):
+            raise ValueError(f"{key} 必须是布尔值")
+    if not isinstance(group_data.get("servers"), list):
+        raise ValueError("servers 必须是列表")
+    for server_data in group_data["servers"]:
+        if not (
+            isinstance(server_data, dict) and
+            isinstance(server_data.get("name"), str) and
+            isinstance(server_data.get("host"), str) and
+            isinstance(server_data.get("port"), int) and
+            isinstance(server_data.get("type"), str) and
+            server_data["type"].lower() in ["java", "bedrock"]
+        ):
+            raise ValueError(f"服务器配置格式错误: {json.dumps(server_data, ensure_ascii=False)}")
 
 
 class Data:
@@ -313,6 +778,7 @@ class Data:
                         "enable": True,
                         "enable_query": True,
                         "enable_check": True,
+                        "enable_players": False,
                         "servers": [
                             {
                                 "name": "服务器名称",
@@ -330,30 +796,114 @@ class Data:
     servers_map: ServersMap
 
     def __init__(self, path="./mcQuery"):
+        self.config_changed = False
+        self.config_file_version = None
+        self.save_task = None  # type: asyncio.Task | None
+        self.save_lock = asyncio.Lock()
         self.servers_map = ServersMap(self)
         self.load_config_data(path)
         self.servers_map.load_data(self.config_data)
 
     def _init_folder(self, path):
-        if not os.path.exists(path):
-            os.mkdir(path)
-        if not os.path.exists(f"{path}\\config_data.json"):
-            with open(f"{path}\\config_data.json", "w", encoding="utf-8") as f:
-                f.write("{}")
+        os.makedirs(path, exist_ok=True)
+        if not os.path.exists(os.path.join(path, "config_data.json")):
+            with open(os.path.join(path, "config_data.json"), "w", encoding="utf-8") as f:
+                json.dump({"enable": True, "bots": {}}, f, indent=4)
 
     def load_config_data(self, path="./mcQuery"):
         self.config_path = path
         self._init_folder(path)
-        with open(f"{path}\\config_data.json", encoding="utf-8") as f:
-            self.config_data = json.load(f)
+        self.config_data, self.config_file_version = self._read_config_data()
+
+    def _read_config_data(self):
+        """
+        读取配置文件
+        返回 (配置数据, 文件版本)
+        """
+        path = os.path.join(self.config_path, "config_data.json")
+        version = get_file_version(path)
+        with open(path, encoding="utf-8") as f:
+            return json.load(f), version
 
     def reload_config_data(self):
+        old_config_data = self.config_data
         self.load_config_data(self.config_path)
-        self.servers_map.reload_data(self.config_data)
+        self.servers_map.reload_data(old_config_data, self.config_data)
+
+    async def check_config_data(self):
+        """
+        配置文件被外部修改时重新加载
+        只重建有改动的群聊,其余服务器的在线状态、缓存和历史记录不受影响
+        """
+        path = os.path.join(self.config_path, "config_data.json")
+        if get_file_version(path) == self.config_file_version:
+            return
+        if self.config_changed or self.save_lock.locked():
+            # 还有未保存或正在写入的修改,不重新加载,保存时外部修改的文件会另存一份
+            return
+        try:
+            config_data, version = await asyncio.to_thread(self._read_config_data)
+        except (OSError, ValueError) as e:
+            # 文件再次修改前不再重试
+            self.config_file_version = get_file_version(path)
+            logger.warning(f"重新加载配置文件失败 {type(e).__name__}: {e}")
+            return
+        if self.config_changed or self.save_lock.locked():
+            return
+        old_config_data = self.config_data
+        self.config_data, self.config_file_version = config_data, version
+        self.servers_map.reload_data(old_config_data, config_data)
+        logger.info("配置文件已修改,重新加载完成")
 
     def save_config_data(self):
-        with open(f"{self.config_path}\\config_data.json", "w", encoding="utf-8") as f:
-            json.dump(self.config_data, f, indent=4, ensure_ascii=False)
+        """
+        保存配置数据
+        短时间内的多次保存合并为一次,在线程中写入,不阻塞事件循环
+        """
+        self.config_changed = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中,直接写入
+            self._write_config_data(json.dumps(self.config_data, ensure_ascii=False))
+            self.config_changed = False
+            return
+        if self.save_task is None or self.save_task.done():
+            self.save_task = loop.create_task(self._save_config_data_later())
+
+    async def _save_config_data_later(self):
+        await asyncio.sleep(plugin_config.QuerySaveDelay)
+        await self.flush_config_data()
+
+    async def flush_config_data(self):
+        """
+        立即写入尚未保存的配置数据
+        """
+        async with self.save_lock:
+            while self.config_changed:
+                self.config_changed = False
+                # 在事件循环中生成快照,避免写入时配置被修改
+                snapshot = json.dumps(self.config_data, ensure_ascii=False)
+                await asyncio.to_thread(self._write_config_data, snapshot)
+
+    def _write_config_data(self, snapshot: str):
+        """
+        先写入临时文件再替换原文件,写入中断时不会损坏原文件
+        原文件在上次读取或保存后被外部修改时,先将其另存,避免外部修改丢失
+        """
+        path = os.path.join(self.config_path, "config_data.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(json.loads(snapshot), f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        version = get_file_version(path)
+        if version is not None and version != self.config_file_version:
+            conflict_path = f"{path}.{time.strftime('%Y%m%d%H%M%S')}.conflict"
+            os.replace(path, conflict_path)
+            logger.warning(f"配置文件被外部修改,与未保存的修改冲突,外部修改已另存为 {conflict_path},请手动合并")
+        os.replace(temp_path, path)
+        self.config_file_version = get_file_version(path)
 
     def get_bots(self):
         return self.config_data["bots"]
@@ -376,6 +926,7 @@ class Data:
                 "enable": False,
                 "enable_query": True,
                 "enable_check": True,
+                "enable_players": False,
                 "enable_custom_query": True,
                 "servers": []
             }
@@ -402,8 +953,9 @@ class Data:
             isinstance(server_data["port"], int) and
             isinstance(server_data["type"], str)
         )
+        self.get_group_data(bot_id, group_id)
         self.config_data["bots"][bot_id]["groups"][group_id]["servers"].append(server_data)
-        self.servers_map.add_server(bot_id, group_id, server_data)
+        self.servers_map.load_group(bot_id, group_id)
         self.save_config_data()
 
     def remove_server(self, bot_id, group_id, server_name) -> bool:
@@ -416,6 +968,6 @@ class Data:
             return False
 
         self.config_data["bots"][bot_id]["groups"][group_id]["servers"].remove(server_data)
-        self.servers_map.remove_group_server(bot_id, group_id, server_data)
+        self.servers_map.load_group(bot_id, group_id)
         self.save_config_data()
         return True
@@ -0,0 +1,79 @@
+import asyncio
+
+from nonebot import get_driver, get_bots
+from nonebot.adapters.onebot.v11 import Message
+from nonebot.log import logger
+
+from .config import Config
+global_config = get_driver().config
+plugin_config = Config.parse_obj(global_config)
+
+
+class Dispatcher:
+    """
+    消息发送队列
+    同一群聊在合并窗口内的消息合并为一条发送,每个机器人按固定间隔依次发送,发送失败时退避重试
+    """
+
+    def __init__(self):
+        self.pending = {}  # type: dict[tuple[str, str], list[Message | str]]
+        self.queues = {}  # type: dict[str, asyncio.Queue[tuple[str, Message]]]
+        self.workers = {}  # type: dict[str, asyncio.Task]
+
+    def send_group_msg(self, bot_id: str, group_id: str, message: Message | str):
+        """
+        添加群聊消息到发送队列
+        """
+        key = (bot_id, group_id)
+        if key in self.pending:
+            self.pending[key].append(message)
+            return
+        self.pending[key] = [message]
+        asyncio.get_running_loop().call_later(plugin_config.QuerySendMergeWindow, self._flush, key)
+
+    def qsize(self) -> int:
+        """
+        等待发送的消息数量
+        """
+        return len(self.pending) + sum(queue.qsize() for queue in self.queues.values())
+
+    def _flush(self, key: tuple[str, str]):
+        """
+        合并窗口结束,将合并后的消息加入机器人的发送队列
+        """
+        bot_id, group_id = key
+        message = Message()
+        for item in self.pending.pop(key):
+            if message:
+                message += "\n"
+            message += item
+        if not bot_id in self.queues:
+            self.queues[bot_id] = asyncio.Queue()
+        self.queues[bot_id].put_nowait((group_id, message))
+        if not bot_id in self.workers:
+            self.workers[bot_id] = asyncio.create_task(self._worker(bot_id))
+
+    async def _worker(self, bot_id: str):
+        queue = self.queues[bot_id]
+        while not queue.empty():
+            group_id, message = queue.get_nowait()
+            await self._send(bot_id, group_id, message)
+            await asyncio.sleep(plugin_config.QuerySendInterval)
+        self.workers.pop(bot_id)
+
+    async def _send(self, bot_id: str, group_id: str, message: Message):
+        for retry in range(plugin_config.QuerySendRetries + 1):
+            bot = get_bots().get(bot_id)
+            if bot is None:
+                logger.warning(f"机器人: {bot_id} 不存在,放弃发送消息到群聊: {group_id}")
+                return
+            try:
+                await bot.call_api("send_group_msg", group_id=group_id, message=message)
+                return
+            except Exception as e:
+                logger.warning(f"发送消息到群聊: {group_id} 失败({retry + 1}/{plugin_config.QuerySendRetries + 1}) {type(e).__name__}: {e}")
+            if retry < plugin_config.QuerySendRetries:
+                await asyncio.sleep(plugin_config.QuerySendRetryDelay * 2 ** retry)
+
+
+message_dispatcher = Dispatcher()
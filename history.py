@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+import time
+
+from nonebot import get_driver
+from mcstatus.pinger import PingResponse
+from mcstatus.bedrock_status import BedrockStatusResponse
+
+from .config import Config
+global_config = get_driver().config
+plugin_config = Config.parse_obj(global_config)
+
+
+class History:
+    """
+    服务器状态历史记录
+    每次查询的结果先缓存在内存中,每轮查询结束后在线程中批量写入SQLite
+    写入时同时累加到分钟、小时、天三级汇总表,查询历史只需读取汇总表
+    """
+
+    # 汇总粒度(秒) => 保留时间(秒)
+    LEVELS = {
+        60: 86400,
+        3600: 86400 * 30,
+        86400: 86400 * 365,
+    }
+    # 原始记录保留时间(秒)
+    RAW_RETENTION = 3600
+    # 清理过期记录的间隔(秒)
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = []  # type: list[tuple[str, int, int, int, int | None, float | None]]
+        self.lock = asyncio.Lock()
+        self.connection = None  # type: sqlite3.Connection | None
+        self.last_prune_time = 0.0
+
+    def record(
+        self, host: str, port: int, online: bool, status: PingResponse | BedrockStatusResponse | None = None,
+        players: int | None = None, latency: float | None = None
+    ):
+        """
+        记录一次查询结果
+        只探测了在线状态时 status 为 None,不记录在线人数和延迟
+        查询子进程只返回在线人数和延迟,直接传入 players 和 latency
+        """
+        if not plugin_config.QueryHistory:
+            return
+        if isinstance(status, PingResponse):
+            players, latency = status.players.online, status.latency
+        elif isinstance(status, BedrockStatusResponse):
+            players, latency = status.players_online, status.latency
+        self.rows.append((host, port, int(time.time()), int(online), players, latency))
+
+    async def flush(self):
+        """
+        写入缓存的查询结果
+        """
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        async with self.lock:
+            await asyncio.to_thread(self._write, rows)
+
+    async def summary(self, host: str, port: int, level: int, span: int):
+        """
+        获取最近 span 秒内的汇总数据
+        返回 (查询次数, 在线次数, 平均在线人数, 最高在线人数, 平均延迟), 没有记录时返回 None
+        """
+        async with self.lock:
+            return await asyncio.to_thread(self._summary, host, port, level, span)
+
+    async def close(self):
+        await self.flush()
+        async with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS raw (
+                    host TEXT NOT NULL,
+                    port INTEGER NOT NULL,
+                    time INTEGER NOT NULL,
+                    online INTEGER NOT NULL,
+                    players INTEGER,
+                    latency REAL
+                );
+                CREATE INDEX IF NOT EXISTS raw_time ON raw (time);
+                CREATE TABLE IF NOT EXISTS rollup (
+                    level INTEGER NOT NULL,
+                    host TEXT NOT NULL,
+                    port INTEGER NOT NULL,
+                    time INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    online_count INTEGER NOT NULL,
+                    players_count INTEGER NOT NULL,
+                    players_sum INTEGER NOT NULL,
+                    players_max INTEGER,
+                    latency_count INTEGER NOT NULL,
+                    latency_sum REAL NOT NULL,
+                    PRIMARY KEY (level, host, port, time)
+                ) WITHOUT ROWID;
+                """
+            )
+        return self.connection
+
+    def _write(self, rows):
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT INTO raw VALUES (?, ?, ?, ?, ?, ?)", rows)
+            for level in self.LEVELS:
+                connection.executemany(
+                    """
+                    INSERT INTO rollup VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (level, host, port, time) DO UPDATE SET
+                        count = count + 1,
+                        online_count = online_count + excluded.online_count,
+                        players_count = players_count + excluded.players_count,
+                        players_sum = players_sum + excluded.players_sum,
+                        players_max = MAX(COALESCE(players_max, excluded.players_max), COALESCE(excluded.players_max, players_max)),
+                        latency_count = latency_count + excluded.latency_count,
+                        latency_sum = latency_sum + excluded.latency_sum
+                    """,
+                    [
+                        (
+                            level, host, port, record_time - record_time % level, online,
+                            int(players is not None), players or 0, players,
+                            int(latency is not None), latency or 0.0,
+                        )
+                        for host, port, record_time, online, players, latency in rows
+                    ]
+                )
+        if time.monotonic() - self.last_prune_time > self.PRUNE_INTERVAL:
+            self._prune()
+
+    def _prune(self):
+        """
+        删除超过保留时间的记录
+        """
+        self.last_prune_time = time.monotonic()
+        now = int(time.time())
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM raw WHERE time < ?", (now - self.RAW_RETENTION,))
+            for level, retention in self.LEVELS.items():
+                connection.execute("DELETE FROM rollup WHERE level = ? AND time < ?", (level, now - retention))
+
+    def _summary(self, host: str, port: int, level: int, span: int):
+        now = int(time.time())
+        count, online_count, players_count, players_sum, players_max, latency_count, latency_sum = self._connect().execute(
+            """
+            SELECT SUM(count), SUM(online_count), SUM(players_count), SUM(players_sum), MAX(players_max), SUM(latency_count), SUM(latency_sum)
+            FROM rollup WHERE level = ? AND host = ? AND port = ? AND time >= ?
+            """,
+            (level, host, port, now - now % level - span + level)
+        ).fetchone()
+        if not count:
+            return None
+        return (
+            count,
+            online_count,
+            players_sum / players_count if players_count else None,
+            players_max,
+            latency_sum / latency_count if latency_count else None,
+        )
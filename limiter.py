@@ -0,0 +1,75 @@
+import time
+
+
+class QueryLimiter:
+    """
+    查询限流
+    每个群聊和全局分别按令牌桶限制查询频率,并分别限制每个群聊和全局同时进行的查询数量
+    """
+
+    def __init__(
+        self, rate: float, burst: int, group_concurrency: int, concurrency: int,
+        global_rate: float, global_burst: int
+    ):
+        # 每分钟的查询次数
+        self.rate = rate / 60
+        self.burst = burst
+        self.global_rate = global_rate / 60
+        self.global_burst = global_burst
+        self.group_concurrency = group_concurrency
+        self.concurrency = concurrency
+        # 令牌已满的群聊不保留令牌桶
+        self.buckets = {}  # type: dict[tuple[str, str], tuple[float, float]]
+        self.global_bucket = (global_burst, time.monotonic())  # type: tuple[float, float]
+        self.running = {}  # type: dict[tuple[str, str], int]
+        self.total = 0
+        self.prune_time = 0.0
+
+    def acquire(self, group_key: tuple[str, str]) -> bool:
+        """
+        尝试开始一次查询,超过限制时返回 False
+        成功后需要调用 release
+        """
+        if self.total >= self.concurrency or self.running.get(group_key, 0) >= self.group_concurrency:
+            return False
+        now = time.monotonic()
+        self._prune(now)
+        tokens = refill(self.buckets.get(group_key), self.rate, self.burst, now)
+        global_tokens = refill(self.global_bucket, self.global_rate, self.global_burst, now)
+        if tokens < 1 or global_tokens < 1:
+            self.buckets[group_key] = (tokens, now)
+            self.global_bucket = (global_tokens, now)
+            return False
+        self.buckets[group_key] = (tokens - 1, now)
+        self.global_bucket = (global_tokens - 1, now)
+        self.running[group_key] = self.running.get(group_key, 0) + 1
+        self.total += 1
+        return True
+
+    def release(self, group_key: tuple[str, str]):
+        self.total -= 1
+        self.running[group_key] -= 1
+        if not self.running[group_key]:
+            self.running.pop(group_key)
+
+    def _prune(self, now: float):
+        """
+        移除令牌已满的令牌桶,每隔令牌恢复满所需的时间清理一次
+        """
+        if now < self.prune_time:
+            return
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if refill(bucket, self.rate, self.burst, now) < self.burst
+        }
+        self.prune_time = now + (self.burst / self.rate if self.rate > 0 else 60)
+
+
+def refill(bucket: tuple[float, float] | None, rate: float, burst: int, now: float) -> float:
+    """
+    令牌桶当前的令牌数量,没有令牌桶时为 burst
+    """
+    if bucket is None:
+        return burst
+    tokens, update_time = bucket
+    return min(burst, tokens + (now - update_time) * rate)
@@ -0,0 +1,198 @@
+import bisect
+from typing import Callable
+
+
+class Metric:
+    """
+    监控指标基类
+    """
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def format_labels(self, label_values: tuple, **extra) -> str:
+        items = [*zip(self.labels, label_values), *extra.items()]
+        if not items:
+            return ""
+        return "{" + ",".join(f'{key}="{escape_label(str(value))}"' for key, value in items) + "}"
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def export(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples()])
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values = {}  # type: dict[tuple, float]
+
+    def inc(self, *label_values, value: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def get(self, *label_values) -> float:
+        return self.values.get(label_values, 0)
+
+    def samples(self):
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """
+    导出时通过回调函数取值的指标
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, function: Callable[[], float] = lambda: 0):
+        super().__init__(name, help)
+        self.function = function
+
+    def get(self) -> float:
+        return self.function()
+
+    def samples(self):
+        return [f"{self.name} {self.get()}"]
+
+
+class LabeledGauge(Metric):
+    """
+    导出时通过回调函数取值的带标签指标
+    回调函数返回 {标签值: 值}
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], function: Callable[[], dict[tuple, float]] = dict):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def get(self) -> dict[tuple, float]:
+        return self.function()
+
+    def samples(self):
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in self.get().items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.values = {}  # type: dict[tuple, list]
+
+    def observe(self, value: float, *label_values):
+        if not label_values in self.values:
+            # [各区间计数..., +Inf区间计数, 总和]
+            self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        data = self.values[label_values]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def _data(self, label_values: tuple) -> list | None:
+        """
+        获取指定标签的数据,有标签的指标未指定标签时合并所有数据
+        """
+        if label_values or not self.labels:
+            return self.values.get(label_values)
+        if not self.values:
+            return None
+        return [sum(items) for items in zip(*self.values.values())]
+
+    def count(self, *label_values) -> int:
+        data = self._data(label_values)
+        return sum(data[:-1]) if data else 0
+
+    def sum(self, *label_values) -> float:
+        data = self._data(label_values)
+        return data[-1] if data else 0.0
+
+    def quantile(self, q: float, *label_values) -> float | None:
+        """
+        按区间线性插值估算分位数
+        """
+        data = self._data(label_values)
+        if not data:
+            return None
+        counts = data[:-1]
+        rank = q * sum(counts)
+        total = 0
+        for i, count in enumerate(counts):
+            if count and total + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - total) / count
+            total += count
+        return self.buckets[-1]
+
+    def samples(self):
+        result = []
+        for key, data in self.values.items():
+            total = 0
+            for bucket, count in zip([*self.buckets, "+Inf"], data[:-1]):
+                total += count
+                result.append(f"{self.name}_bucket{self.format_labels(key, le=bucket)} {total}")
+            result.append(f"{self.name}_sum{self.format_labels(key)} {data[-1]}")
+            result.append(f"{self.name}_count{self.format_labels(key)} {total}")
+        return result
+
+
+class Metrics:
+    """
+    插件运行状态指标
+    """
+
+    def __init__(self):
+        self.cycle_duration = Histogram(
+            "mcquery_cycle_duration_seconds", "定时查询每轮耗时"
+        )
+        self.probe_duration = Histogram(
+            "mcquery_probe_duration_seconds", "单个服务器查询耗时", ("type", "mode")
+        )
+        # 只包含监测的服务器,数量与监测的服务器相同
+        self.server_probe_duration = LabeledGauge(
+            "mcquery_server_probe_seconds", "各服务器查询耗时的指数移动平均", ("type", "host", "port")
+        )
+        self.probe_errors = Counter(
+            "mcquery_probe_errors_total", "服务器查询失败次数", ("type", "error")
+        )
+        self.cycle_unknown = Counter(
+            "mcquery_cycle_unknown_total", "未在每轮查询时限内完成的服务器数量"
+        )
+        self.cache_requests = Counter(
+            "mcquery_cache_requests_total", "缓存命中情况", ("cache", "result")
+        )
+        self.servers = Gauge(
+            "mcquery_servers", "监测的服务器数量"
+        )
+        self.breaker_open = Gauge(
+            "mcquery_breaker_open_servers", "熔断中的服务器数量"
+        )
+        self.send_queue_depth = Gauge(
+            "mcquery_send_queue_depth", "等待发送的通知数量"
+        )
+
+    def cache_hit_rate(self, cache: str) -> float | None:
+        hit = self.cache_requests.get(cache, "hit")
+        miss = self.cache_requests.get(cache, "miss")
+        return hit / (hit + miss) if hit + miss else None
+
+    def export(self) -> str:
+        """
+        导出Prometheus文本格式
+        """
+        metrics = [value for value in vars(self).values() if isinstance(value, Metric)]
+        return "\n".join(metric.export() for metric in metrics) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = Metrics()
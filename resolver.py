@@ -0,0 +1,101 @@
+import asyncio
+import ipaddress
+import socket
+import time
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from nonebot import get_driver
+from nonebot.log import logger
+
+from .metrics import metrics
+from .config import Config
+global_config = get_driver().config
+plugin_config = Config.parse_obj(global_config)
+
+
+class Resolver:
+    """
+    域名解析缓存
+    按域名缓存解析结果,有效期遵循DNS记录的TTL,解析失败的域名也会缓存一段时间
+    """
+
+    def __init__(self):
+        self.resolver = dns.asyncresolver.Resolver()
+        self.data = {}  # type: dict[str, tuple[float, str | None]]
+        self.resolving_tasks = {}  # type: dict[str, asyncio.Task]
+
+    async def resolve(self, host: str) -> str:
+        """
+        解析域名为ip
+        解析失败抛出 socket.gaierror
+        """
+        if is_ip_address(host):
+            return host
+        if host in self.data:
+            expire_time, ip = self.data[host]
+            if time.monotonic() < expire_time:
+                metrics.cache_requests.inc("dns", "hit")
+                if ip is None:
+                    raise socket.gaierror(f"无法解析域名: {host}")
+                return ip
+            self.data.pop(host)
+        metrics.cache_requests.inc("dns", "miss")
+        task = self.resolving_tasks.get(host)
+        if task is None:
+            task = asyncio.create_task(self._resolve(host))
+            self.resolving_tasks[host] = task
+            task.add_done_callback(lambda _: self.resolving_tasks.pop(host, None))
+        ip = await asyncio.shield(task)
+        if ip is None:
+            raise socket.gaierror(f"无法解析域名: {host}")
+        return ip
+
+    async def _resolve(self, host: str):
+        """
+        解析域名并写入缓存
+        """
+        now = time.monotonic()
+        try:
+            answer = await self._query(host)
+            ip = answer[0].to_text()
+            ttl = min(max(answer.rrset.ttl, plugin_config.QueryDnsMinTTL), plugin_config.QueryDnsMaxTTL)  # type: ignore
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers, dns.exception.Timeout):
+            # 不在DNS中的域名(如hosts文件中的域名)交给系统解析
+            ip = await self._resolve_system(host)
+            ttl = plugin_config.QueryDnsMinTTL if ip is not None else plugin_config.QueryDnsNegativeTTL
+            if ip is None:
+                logger.debug(f"无法解析域名: {host}")
+        if len(self.data) >= plugin_config.QueryCacheSize:
+            # 清理过期的记录
+            self.data = {key: value for key, value in self.data.items() if value[0] > now}
+        self.data[host] = (now + ttl, ip)
+        return ip
+
+    async def _query(self, host: str):
+        """
+        查询A记录,域名只有IPv6地址时查询AAAA记录
+        """
+        try:
+            return await self.resolver.resolve(host, "A", lifetime=plugin_config.QueryTimeout)
+        except dns.resolver.NoAnswer:
+            return await self.resolver.resolve(host, "AAAA", lifetime=plugin_config.QueryTimeout)
+
+    async def _resolve_system(self, host: str):
+        try:
+            result = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            return None
+        return result[0][4][0] if result else None
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+resolver = Resolver()
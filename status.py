@@ -0,0 +1,121 @@
+import json
+import re
+from time import perf_counter
+
+from mcstatus.pinger import AsyncServerPinger, PingResponse
+from mcstatus.protocol.connection import Connection
+
+# 键名和值之间的冒号
+COLON_PATTERN = re.compile(rb"\s*:\s*")
+
+
+class JavaStatus(PingResponse):
+    """
+    按需解析的JAVA服务器状态
+    不解析描述和未使用的玩家列表,图标保留原始字节,用到时才解码
+    """
+
+    def __init__(self, raw: dict, latency: float, favicon_raw: bytes | None):
+        self.raw = raw
+        self.latency = latency
+        self.favicon_raw = favicon_raw
+        if not isinstance(raw, dict):
+            raise ValueError(f"Invalid status object (expected dict, found {type(raw)})")
+        players = raw.get("players")
+        if not isinstance(players, dict) or not isinstance(players.get("online"), int) or not isinstance(players.get("max"), int):
+            raise ValueError("Invalid players object")
+        self.players = PingResponse.Players.__new__(PingResponse.Players)
+        self.players.online = players["online"]
+        self.players.max = players["max"]
+        self.players.sample = None
+        if "sample" in players:
+            if not isinstance(players["sample"], list):
+                raise ValueError("Invalid players object (expected 'sample' to be list)")
+            self.players.sample = [PingResponse.Players.Player(player) for player in players["sample"]]
+        if "version" not in raw:
+            raise ValueError("Invalid status object (no 'version' value)")
+        self.version = PingResponse.Version(raw["version"])
+
+    @property
+    def description(self) -> str:  # type: ignore
+        return self._parse_description(self.raw.get("description", ""))
+
+    @property
+    def favicon(self) -> str | None:  # type: ignore
+        if self.favicon_raw is None:
+            return None
+        return decode_favicon(self.favicon_raw)
+
+
+def decode_favicon(favicon_raw: bytes) -> str:
+    return favicon_raw.decode().replace("\\/", "/")
+
+
+def find_value(data: bytes, key: bytes) -> int:
+    """
+    查找键对应的值的起始位置,不存在时返回 -1
+    字符串中的引号都经过转义,不会被误认为键名
+    """
+    index = data.find(key)
+    while index != -1:
+        if index == 0 or data[index - 1] != 0x5C:
+            match = COLON_PATTERN.match(data, index + len(key))
+            if match is not None:
+                return match.end()
+        index = data.find(key, index + 1)
+    return -1
+
+
+def parse_status(data: bytes, latency: float, favicon: bool, sample: bool) -> JavaStatus:
+    """
+    解析状态JSON
+    解析前先从原始字节中切掉图标和玩家列表,避免为其创建对象
+    favicon 为 False 时丢弃图标, sample 为 False 时丢弃玩家列表
+    """
+    favicon_raw = None
+    start = find_value(data, b'"favicon"')
+    if start != -1 and data[start:start + 1] == b'"':
+        # 图标中不会出现引号
+        end = data.find(b'"', start + 1)
+        if end != -1:
+            if favicon:
+                favicon_raw = data[start + 1:end]
+            data = data[:start + 1] + data[end:]
+    raw = None
+    if not sample:
+        start = find_value(data, b'"sample"')
+        if start != -1 and data[start:start + 1] == b"[":
+            # 玩家名称中可能包含 ] 切掉后无法解析时重新解析完整的JSON
+            end = data.find(b"]", start)
+            try:
+                raw = json.loads(data[:start + 1].decode() + data[end:].decode())
+            except ValueError:
+                raw = None
+            if isinstance(raw, dict) and isinstance(raw.get("players"), dict):
+                raw["players"].pop("sample", None)
+    try:
+        if raw is None:
+            raw = json.loads(data.decode())
+    except ValueError:
+        raise IOError("Received invalid JSON")
+    try:
+        return JavaStatus(raw, latency, favicon_raw)
+    except ValueError as e:
+        raise IOError(f"Received invalid status response: {e}")
+
+
+async def read_status(pinger: AsyncServerPinger, favicon: bool, sample: bool) -> JavaStatus:
+    """
+    与 AsyncServerPinger.read_status 相同,只解析需要的字段
+    """
+    request = Connection()
+    request.write_varint(0)
+    pinger.connection.write_buffer(request)
+
+    start = perf_counter()
+    response = await pinger.connection.read_buffer()
+    received = perf_counter()
+    if response.read_varint() != 0:
+        raise IOError("Received invalid status response packet.")
+    data = bytes(response.read(response.read_varint()))
+    return parse_status(data, (received - start) * 1000, favicon, sample)
@@ -0,0 +1,163 @@
+import re
+from collections import OrderedDict
+from string import Formatter
+from typing import Callable, Mapping
+
+from nonebot import get_driver
+from nonebot.adapters.onebot.v11 import Message, MessageSegment
+
+from .metrics import metrics
+from .config import Config
+global_config = get_driver().config
+plugin_config = Config.parse_obj(global_config)
+
+
+# 各类消息可以使用的字段
+SERVER_FIELDS = {"server_name", "server_type", "server_host", "server_port", "bot_id", "group_id"}
+ONLINE_FIELDS = SERVER_FIELDS | {"server_latency"}
+JAVA_FIELDS = ONLINE_FIELDS | {
+    "server_favicon",
+    "server_version",
+    "server_version_name",
+    "server_version_protocol",
+    "server_players_max",
+    "server_players_online",
+}
+BEDROCK_FIELDS = ONLINE_FIELDS | {
+    "server_version",
+    "server_version_brand",
+    "server_version_protocol",
+    "server_players_max",
+    "server_players_online",
+}
+PLAYERS_FIELDS = SERVER_FIELDS | {"players", "players_count"}
+
+
+class MessageRenderer:
+    """
+    预编译的消息模板
+    加载时解析模板并检查字段,渲染时只需按顺序填入字段
+    """
+
+    formatter = Formatter()
+
+    def __init__(self, name: str, template: str, fields: set[str]):
+        self.name = name
+        self.template = template
+        self.parts = []  # type: list[tuple[str, str | None, str, str | None]]
+        # 模板实际使用的字段
+        self.fields = set()  # type: set[str]
+        try:
+            parsed = list(self.formatter.parse(template))
+        except ValueError as e:
+            raise ValueError(f"消息模板 {name} 格式错误: {e}")
+        for literal, field_name, format_spec, conversion in parsed:
+            if field_name is not None:
+                key = re.split(r"[.\[]", field_name, 1)[0]
+                if not key in fields:
+                    raise ValueError(f"消息模板 {name} 使用了未知字段: {{{field_name}}}")
+                self.fields.add(key)
+            self.parts.append((literal, field_name, format_spec or "", conversion))
+        # 模板使用的订阅相关字段,其余字段都来自服务器状态
+        self.subscription_fields = tuple(sorted(self.fields & SERVER_FIELDS))
+
+    def render(self, **format_data) -> Message:
+        message = Message()
+        text = ""
+        for literal, field_name, format_spec, conversion in self.parts:
+            text += literal
+            if field_name is None:
+                continue
+            value = self.formatter.get_field(field_name, (), format_data)[0]
+            if isinstance(value, (Message, MessageSegment)):
+                if text:
+                    message += MessageSegment.text(text)
+                    text = ""
+                message += value
+            else:
+                value = self.formatter.convert_field(value, conversion)
+                text += self.formatter.format_field(value, format_spec)
+        if text:
+            message += MessageSegment.text(text)
+        return message
+
+
+class Templates:
+    """
+    Config.format 中用于服务器消息的模板
+    启动时编译,模板中有未知字段时抛出 ValueError
+    """
+
+    def __init__(self, format):
+        self.server_java = MessageRenderer(
+            "server_java_msg", f"{format.server_title}\n{format.server_java_msg}", JAVA_FIELDS
+        )
+        self.server_bedrock = MessageRenderer(
+            "server_bedrock_msg", f"{format.server_title}\n{format.server_bedrock_msg}", BEDROCK_FIELDS
+        )
+        self.server_offline = MessageRenderer(
+            "server_offline", f"{format.server_title}\n{format.server_offline}", SERVER_FIELDS
+        )
+        self.server_timeout = MessageRenderer(
+            "server_timeout", f"{format.server_title}\n{format.server_timeout}", SERVER_FIELDS
+        )
+        self.server_error = MessageRenderer(
+            "server_title", f"{format.server_title}\n未知错误", SERVER_FIELDS
+        )
+        self.server_state_change_online = MessageRenderer(
+            "server_state_change_online", format.server_state_change_online, SERVER_FIELDS
+        )
+        self.server_state_change_offline = MessageRenderer(
+            "server_state_change_offline", format.server_state_change_offline, SERVER_FIELDS
+        )
+        self.server_players_join = MessageRenderer(
+            "server_players_join", format.server_players_join, PLAYERS_FIELDS
+        )
+        self.server_players_leave = MessageRenderer(
+            "server_players_leave", format.server_players_leave, PLAYERS_FIELDS
+        )
+        # 玩家变化消息由加入和离开两个模板组成,缓存时按两者使用的订阅字段区分
+        self.server_players_change_fields = tuple(sorted(
+            set(self.server_players_join.subscription_fields) | set(self.server_players_leave.subscription_fields)
+        ))
+
+
+class RenderCache:
+    """
+    渲染结果缓存
+    按 (服务器, 模板, 模板使用的订阅字段) 缓存最近一次渲染的消息,服务器状态改变后重新渲染
+    模板未使用群聊相关字段时,订阅同一服务器的群聊共用渲染结果
+    缓存的消息会被多个群聊共用,不能修改
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.data = OrderedDict()  # type: OrderedDict[tuple, tuple[object, Message]]
+
+    def get(
+        self, renderer: MessageRenderer, server_key: tuple[str, str, int], status, format_data: Mapping[str, object],
+        render: Callable[[], Message], subscription_fields: tuple[str, ...] | None = None
+    ) -> Message:
+        """
+        status 为渲染使用的服务器状态,与缓存的状态不是同一个对象时调用 render 重新渲染
+        消息由多个模板组成时, subscription_fields 为所有模板使用的订阅字段
+        """
+        if subscription_fields is None:
+            subscription_fields = renderer.subscription_fields
+        key = (server_key, renderer.name, tuple(format_data[field] for field in subscription_fields))
+        item = self.data.get(key)
+        if item is not None and item[0] is status:
+            metrics.cache_requests.inc("render", "hit")
+            self.data.move_to_end(key)
+            return item[1]
+        metrics.cache_requests.inc("render", "miss")
+        message = render()
+        self.data[key] = (status, message)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+        return message
+
+
+templates = Templates(plugin_config.format)
+render_cache = RenderCache(plugin_config.QueryRenderCacheSize)
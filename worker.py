@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from mcstatus.address import Address
+from mcstatus.pinger import AsyncServerPinger
+from mcstatus.protocol.connection import TCPAsyncSocketConnection
+
+from .bedrock import BedrockProber
+from .status import read_status
+
+# 子进程中运行,不能依赖 NoneBot
+
+
+class ProbeResult:
+    """
+    子进程返回的查询结果
+    """
+    __slots__ = ("type", "host", "port", "online", "players", "latency", "error", "duration")
+
+    def __init__(self, type: str, host: str, port: int, online: bool, players: int | None, latency: float | None, error: str | None, duration: float):
+        self.type = type
+        self.host = host
+        self.port = port
+        self.online = online
+        self.players = players
+        self.latency = latency
+        self.error = error
+        self.duration = duration
+
+    def __reduce__(self):
+        return (ProbeResult, (self.type, self.host, self.port, self.online, self.players, self.latency, self.error, self.duration))
+
+
+async def probe_server(server_type: str, host: str, ip: str, port: int, mode: str, timeout: float, bedrock_prober: BedrockProber):
+    """
+    查询单个服务器
+    返回 (在线人数, 延迟), 只探测在线状态时均为 None
+    """
+    if server_type == "bedrock":
+        status = await bedrock_prober.status(ip, port)
+        return status.players_online, status.latency
+    if mode == "tcp":
+        reader, writer = await asyncio.open_connection(ip, port)
+        writer.close()
+        await writer.wait_closed()
+        return None, None
+    async with TCPAsyncSocketConnection(Address(ip, port), timeout) as connection:
+        pinger = AsyncServerPinger(connection, address=Address(host, port))
+        pinger.handshake()
+        if mode == "ping":
+            await pinger.test_ping()
+            return None, None
+        status = await read_status(pinger, False, False)
+        return status.players.online, status.latency
+
+
+async def probe_servers_async(servers: list[tuple[str, str, str, int]], mode: str, timeout: float, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    bedrock_prober = BedrockProber(timeout)
+
+    async def probe(server_type: str, host: str, ip: str, port: int):
+        async with semaphore:
+            start_time = time.monotonic()
+            try:
+                players, latency = await asyncio.wait_for(probe_server(server_type, host, ip, port, mode, timeout, bedrock_prober), timeout)
+            except asyncio.TimeoutError:
+                return ProbeResult(server_type, host, port, False, None, None, "Timeout", time.monotonic() - start_time)
+            except Exception as e:
+                return ProbeResult(server_type, host, port, False, None, None, type(e).__name__, time.monotonic() - start_time)
+            return ProbeResult(server_type, host, port, True, players, latency, None, time.monotonic() - start_time)
+
+    try:
+        return await asyncio.gather(*[probe(*server) for server in servers])
+    finally:
+        bedrock_prober.close()
+
+
+def probe_servers(servers: list[tuple[str, str, str, int]], mode: str, timeout: float, concurrency: int) -> list[ProbeResult]:
+    """
+    子进程入口,在独立的事件循环中查询一组服务器
+    servers 为 (类型, 域名, ip, 端口) 列表
+    """
+    return asyncio.run(probe_servers_async(servers, mode, timeout, concurrency))
+
+
+class WorkerPool:
+    """
+    查询子进程池
+    按服务器地址的hash将服务器分配到各个子进程,主进程只负责对比状态和发送通知
+    """
+
+    def __init__(self, workers: int, concurrency: int):
+        self.workers = workers
+        self.concurrency = max(1, concurrency // workers)
+        # 子进程无法重新导入插件,只能使用fork
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+
+    def shard(self, host: str, port: int) -> int:
+        return zlib.crc32(f"{host}:{port}".encode()) % self.workers
+
+    def probe(self, servers: list[tuple[str, str, str, int]], mode: str, timeout: float) -> list[asyncio.Future[list[ProbeResult]]]:
+        """
+        分片提交查询任务
+        返回每个分片的 Future,先完成的分片可以先处理
+        """
+        shards = [[] for _ in range(self.workers)]  # type: list[list[tuple[str, str, str, int]]]
+        for server in servers:
+            shards[self.shard(server[1], server[3])].append(server)
+        loop = asyncio.get_running_loop()
+        return [
+            asyncio.wrap_future(self.executor.submit(probe_servers, shard, mode, timeout, self.concurrency), loop=loop)
+            for shard in shards if shard
+        ]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fork_available() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()